@@ -1,4 +1,8 @@
+import os
 import re
+import sys
+import time
+from collections import deque
 
 class JackTokenizer:
     # Jack 語言的關鍵字列表
@@ -7,68 +11,77 @@ class JackTokenizer:
         'int', 'char', 'boolean', 'void', 'true', 'false', 'null', 'this',
         'let', 'do', 'if', 'else', 'while', 'return'
     }
-    
+
     # 符號集合
     SYMBOLS = {'{', '}', '(', ')', '[', ']', '.', ',', ';', '+', '-', '*', '/', '&', '|', '<', '>', '=', '~'}
-    
+
     # XML 轉義對照表
     XML_ENTITY = {'<': '&lt;', '>': '&gt;', '"': '&quot;', '&': '&amp;'}
 
+    # master regex：同時處理註解與所有 token 類型 (註解放最前面，才不會被當成 '/' 符號)。
+    # 在類別層級編譯一次，同一個 process 裡所有檔案共用，不用每建一個 tokenizer 就重組一次
+    # 關鍵字：用 (?!\w) 確保不會匹配到變數的前綴 (如 classVar)
+    MASTER_REGEX = re.compile('|'.join([
+        r'(?P<COMMENT>//[^\n]*|/\*.*?\*/)',
+        r'(?P<OPEN_COMMENT>/\*)', # 區塊註解在這一段裡還沒結束
+        r'(?P<STRING_CONST>"[^"\n]*")',
+        r'(?P<KEYWORD>(?:' + '|'.join(re.escape(k) for k in sorted(KEYWORDS)) + r')(?!\w))',
+        r'(?P<SYMBOL>[' + re.escape(''.join(sorted(SYMBOLS))) + r'])',
+        r'(?P<INT_CONST>\d+)',
+        r'(?P<IDENTIFIER>[a-zA-Z_]\w*)',
+    ]), re.DOTALL)
+
     def __init__(self, input_file):
-        with open(input_file, 'r') as f:
-            content = f.read()
-        
-        self.tokens = self._tokenize(content)
-        self.current_token_idx = 0
+        # 不再一次讀完整個檔案：token 由 generator 逐行產生，需要時才讀下一行，
+        # 記憶體只跟「一行 + 跨行的區塊註解」有關，第一個 token 馬上就能拿到
+        self.stream = self._tokenize(input_file)
+        self.lookahead = deque() # peek 用的小緩衝 (已經從 stream 取出、還沒 advance 到的 token)
         self.current_token = None # (Type, Value)
 
-    def _tokenize(self, content):
-        # 1. 移除註解
-        content = re.sub(r'/\*\*.*?\*/', ' ', content, flags=re.DOTALL) 
-        content = re.sub(r'//.*', ' ', content)
-        
-        # 2. 定義 Token 的 Regex (修正：移除外層多餘括號，並分開定義以增加可讀性)
-        # 關鍵字：使用 \b 邊界或 (?!\w) 確保不會匹配到變數的前綴 (如 classVar)
-        # 這裡我們用 re.escape 確保安全，雖然關鍵字都是英文
-        kws = '|'.join(re.escape(k) for k in self.KEYWORDS)
-        keyword_regex = r'(?P<KEYWORD>(' + kws + r')(?!\w))'
-        
-        symbol_regex = r'(?P<SYMBOL>[' + re.escape(''.join(self.SYMBOLS)) + r'])'
-        int_regex = r'(?P<INT_CONST>\d+)'
-        string_regex = r'(?P<STRING_CONST>"[^"\n]*")'
-        id_regex = r'(?P<IDENTIFIER>[a-zA-Z_]\w*)'
-
-        # 將所有規則用 | (OR) 連接起來
-        regex = '|'.join([keyword_regex, symbol_regex, int_regex, string_regex, id_regex])
-        
-        tokens = []
-        for match in re.finditer(regex, content):
-            # 安全檢查：確保 lastgroup 存在
-            if match.lastgroup:
-                token_type = match.lastgroup
-                token_val = match.group(token_type)
-                
-                if token_type == 'STRING_CONST':
-                    # 去除字串前後的引號: "Hello" -> Hello
-                    tokens.append(('STRING_CONST', token_val[1:-1]))
-                elif token_type == 'INT_CONST':
-                    tokens.append(('INT_CONST', token_val))
-                elif token_type == 'KEYWORD':
-                    # 因為我們的 regex 結構是 ((k1|k2..)(?!\w))，group 抓到的可能會包含 lookahead 的部分(雖然 lookahead 不佔字元)
-                    # 為了保險，我們只取單字部分，但通常 token_val 就已經正確了
-                    tokens.append(('KEYWORD', token_val))
-                else:
-                    tokens.append((token_type, token_val))
-                    
-        return tokens
+    def _tokenize(self, input_file):
+        """逐行掃描，一次產生一個 (Type, Value)；跨行的區塊註解會把後面幾行接起來再繼續掃"""
+        search = self.MASTER_REGEX.search
+        with open(input_file, 'r') as f:
+            for chunk in f:
+                position = 0
+                while True:
+                    match = search(chunk, position)
+                    if match is None:
+                        break
+                    token_type = match.lastgroup
+                    if token_type == 'OPEN_COMMENT':
+                        # 讀到註解結束為止，從 /* 開始重新掃描這一段
+                        chunk = chunk[match.start():]
+                        for line in f:
+                            chunk += line
+                            if '*/' in line:
+                                break
+                        else:
+                            return # 註解沒有結束就到檔尾了
+                        position = 0
+                        continue
+                    position = match.end()
+                    if token_type == 'STRING_CONST':
+                        # 去除字串前後的引號: "Hello" -> Hello
+                        yield ('STRING_CONST', match.group()[1:-1])
+                    elif token_type != 'COMMENT':
+                        yield (token_type, match.group())
+
+    def _fill(self):
+        """確保 lookahead 裡至少有一個 token；檔案結束時回傳 False"""
+        if not self.lookahead:
+            token = next(self.stream, None)
+            if token is None:
+                return False
+            self.lookahead.append(token)
+        return True
 
     def hasMoreTokens(self):
-        return self.current_token_idx < len(self.tokens)
+        return self._fill()
 
     def advance(self):
-        if self.hasMoreTokens():
-            self.current_token = self.tokens[self.current_token_idx]
-            self.current_token_idx += 1
+        if self._fill():
+            self.current_token = self.lookahead.popleft()
 
     # 以下是用於獲取當前 token 資訊的 API
     def tokenType(self):
@@ -88,9 +101,32 @@ class JackTokenizer:
 
     def stringVal(self):
         return self.current_token[1]
-    
+
     # 輔助：偷看下一個 Token (用於 LL(2) 分析，如區分變數與陣列)
     def peek(self):
-        if self.current_token_idx < len(self.tokens):
-            return self.tokens[self.current_token_idx]
-        return None
\ No newline at end of file
+        if self._fill():
+            return self.lookahead[0]
+        return None
+
+def benchmark(path, repeat=20):
+    """
+    量測 tokenizer 吞吐量：path 可以是單一 .jack 或目錄 (目錄下每個檔案各建一個 JackTokenizer)。
+    重複 repeat 次，回傳 (檔案數, token 數, 秒數)。
+    """
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.jack'))
+    else:
+        files = [path]
+    count = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for jack_file in files:
+            for _ in JackTokenizer(jack_file).stream:
+                count += 1
+    return len(files), count, time.perf_counter() - start
+
+if __name__ == "__main__":
+    # 用法：python JackTokenizer.py <file.jack 或目錄> ...
+    for path in sys.argv[1:]:
+        files, count, elapsed = benchmark(path)
+        print(f"{path}: {files} files, {count} tokens in {elapsed * 1000:.1f} ms ({count / elapsed:,.0f} tokens/s)")
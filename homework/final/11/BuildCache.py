@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+
+# 快取格式版本；格式改變時遞增，舊的快取自動失效
+CACHE_VERSION = 2
+
+# 編譯器本身的原始碼：任何一個改了，之前產生的 .vm 都不能再用
+COMPILER_SOURCES = ('JackTokenizer.py', 'CompilationEngine.py', 'SymbolTable.py', 'VMWriter.py')
+
+def compiler_version():
+    """編譯器原始碼的 SHA-256，當成「編譯器版本」"""
+    digest = hashlib.sha256()
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in COMPILER_SOURCES:
+        with open(os.path.join(base_dir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class BuildCache:
+    """
+    增量編譯用的快取 (cache_dir/manifest.json)。以 .jack 的絕對路徑為 key，每個檔案記錄：
+    - source_hash：.jack 內容的 SHA-256。
+    - vm_hash：上次產生的 VM 程式碼的 SHA-256。
+    .jack 內容與編譯器版本都沒變，而且磁碟上的 .vm 還是上次產生的那一份，就不用重新編譯。
+
+    不需要追蹤跨 class 的相依：_compileSubroutineCall 判斷 method / function 只看呼叫端自己的
+    符號表 (first_name 是不是變數)，不會去看被呼叫的 class 怎麼宣告，所以一個 class 的輸出只由它自己的原始碼決定。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_file = os.path.join(cache_dir, 'manifest.json')
+        self.compiler = compiler_version()
+        self.files = {}
+        self.hashes = {} # 這次建置讀到的 source_hash
+        if os.path.exists(self.cache_file):
+            with open(self.cache_file, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == CACHE_VERSION and manifest.get('compiler') == self.compiler:
+                self.files = manifest['files']
+
+    def prune(self):
+        """刪掉 .jack 已經不存在的紀錄 (只編譯目錄裡的部分檔案時，其他檔案的紀錄照樣保留)"""
+        for path in [path for path in self.files if not os.path.exists(path)]:
+            del self.files[path]
+
+    def stale_files(self, jack_files):
+        """內容或編譯器變了、沒有快取紀錄，或是 .vm 不見了 / 被別的方式改寫過的檔案"""
+        stale = []
+        for jack_file in jack_files:
+            path = os.path.abspath(jack_file)
+            source_hash = file_hash(jack_file)
+            self.hashes[path] = source_hash
+            entry = self.files.get(path)
+            vm_file = jack_file.replace('.jack', '.vm')
+            if entry is None or entry['source_hash'] != source_hash or \
+               not os.path.exists(vm_file) or file_hash(vm_file) != entry['vm_hash']:
+                stale.append(jack_file)
+        return stale
+
+    def update(self, jack_file):
+        """記錄剛編譯好的檔案；vm_hash 直接讀寫好的 .vm 計算，和 stale_files 比對的是同一份內容"""
+        path = os.path.abspath(jack_file)
+        self.files[path] = {
+            'source_hash': self.hashes[path],
+            'vm_hash': file_hash(jack_file.replace('.jack', '.vm')),
+        }
+
+    def forget(self, jack_file):
+        """編譯失敗的檔案不留紀錄，下次一定重新編譯"""
+        self.files.pop(os.path.abspath(jack_file), None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_file = self.cache_file + f'.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(json.dumps({
+                'version': CACHE_VERSION,
+                'compiler': self.compiler,
+                'files': self.files,
+            }))
+        os.replace(tmp_file, self.cache_file)
@@ -1,8 +1,23 @@
 from SymbolTable import SymbolTable
 from VMWriter import VMWriter 
-# 假設你的 Tokenizer 方法是 camelCase (tokenType, keyWord...)
+from JackTokenizer import (KEYWORD, SYMBOL, IDENTIFIER, INT_CONST, STRING_CONST,
+                           K_CONSTRUCTOR, K_FUNCTION, K_METHOD, K_FIELD, K_STATIC, K_VAR,
+                           K_TRUE, K_FALSE, K_NULL, K_THIS, K_LET, K_DO, K_IF, K_ELSE, K_WHILE, K_RETURN,
+                           S_LPAREN, S_RPAREN, S_LBRACKET, S_DOT, S_COMMA, S_SEMICOLON,
+                           S_PLUS, S_MINUS, S_STAR, S_SLASH, S_AND, S_OR, S_LT, S_GT, S_EQ, S_NOT)
+# Tokenizer 的 kind / value 都是整數：關鍵字是 K_*、符號是 S_*，直接比對整數，不用每次比字串
 
 class CompilationEngine:
+    # 二元運算子 -> VM 算術指令；* 和 / 要呼叫 OS
+    ARITHMETIC_OPS = {S_PLUS: 'ADD', S_MINUS: 'SUB', S_AND: 'AND', S_OR: 'OR',
+                      S_LT: 'LT', S_GT: 'GT', S_EQ: 'EQ'}
+    CALL_OPS = {S_STAR: 'Math.multiply', S_SLASH: 'Math.divide'}
+    BINARY_OPS = frozenset(ARITHMETIC_OPS) | frozenset(CALL_OPS)
+
+    # 類別變數宣告的關鍵字 -> SymbolTable 的 kind
+    CLASS_VAR_KINDS = {K_STATIC: 'STATIC', K_FIELD: 'FIELD'}
+    SUBROUTINE_KEYWORDS = frozenset((K_CONSTRUCTOR, K_FUNCTION, K_METHOD))
+
     def __init__(self, tokenizer, output_file):
         self.tokenizer = tokenizer
         # VMWriter 直接使用傳入的檔案物件
@@ -35,13 +50,11 @@ class CompilationEngine:
         self.tokenizer.advance()
 
         # 4. ClassVarDec
-        while self.tokenizer.tokenType() == 'KEYWORD' and \
-              self.tokenizer.keyWord() in ['STATIC', 'FIELD']:
+        while self.tokenizer.value in self.CLASS_VAR_KINDS:
             self.compileClassVarDec()
 
         # 5. Subroutine
-        while self.tokenizer.tokenType() == 'KEYWORD' and \
-              self.tokenizer.keyWord() in ['CONSTRUCTOR', 'FUNCTION', 'METHOD']:
+        while self.tokenizer.value in self.SUBROUTINE_KEYWORDS:
             self.compileSubroutine()
 
         # 6. '}'
@@ -49,20 +62,20 @@ class CompilationEngine:
 
     def compileClassVarDec(self):
         # 結構: static/field type name, name;
-        kind = self.tokenizer.keyWord() # static / field
+        kind = self.CLASS_VAR_KINDS[self.tokenizer.value] # static / field
         self.tokenizer.advance()
         
         type = self._getCurrentType() # 取得 int, boolean 或 class name
         self.tokenizer.advance()
         
         name = self.tokenizer.identifier()
-        self.symbol_table.define(name, type, kind.upper()) # 加入符號表
+        self.symbol_table.define(name, type, kind) # 加入符號表
         self.tokenizer.advance()
         
-        while self.tokenizer.tokenType() == 'SYMBOL' and self.tokenizer.symbol() == ',':
+        while self.tokenizer.value == S_COMMA:
             self.tokenizer.advance() # ,
             name = self.tokenizer.identifier()
-            self.symbol_table.define(name, type, kind.upper())
+            self.symbol_table.define(name, type, kind)
             self.tokenizer.advance()
             
         self.tokenizer.advance() # ;
@@ -71,7 +84,7 @@ class CompilationEngine:
         # 1. 重置 Subroutine 符號表
         self.symbol_table.start_subroutine()
         
-        func_type = self.tokenizer.keyWord() # constructor, function, method
+        func_type = self.tokenizer.value # K_CONSTRUCTOR, K_FUNCTION, K_METHOD
         self.tokenizer.advance()
         
         self.tokenizer.advance() # void or return type
@@ -87,7 +100,7 @@ class CompilationEngine:
         self.tokenizer.advance() # {
         
         # 先編譯變數宣告 (VarDec)
-        while self.tokenizer.tokenType() == 'KEYWORD' and self.tokenizer.keyWord() == 'VAR':
+        while self.tokenizer.value == K_VAR:
             self.compileVarDec()
             
         # 計算 local 變數數量
@@ -98,12 +111,12 @@ class CompilationEngine:
         self.vm_writer.write_function(full_func_name, n_locals)
         
         # === 處理 Method 和 Constructor 的特殊記憶體操作 ===
-        if func_type == 'METHOD':
+        if func_type == K_METHOD:
             # Method 的第一個參數是 this，需要對齊
             self.vm_writer.write_push('ARG', 0)
             self.vm_writer.write_pop('POINTER', 0) # this = argument 0
             
-        elif func_type == 'CONSTRUCTOR':
+        elif func_type == K_CONSTRUCTOR:
             # Constructor 需要分配記憶體
             n_fields = self.symbol_table.var_count('FIELD')
             self.vm_writer.write_push('CONST', n_fields)
@@ -116,7 +129,7 @@ class CompilationEngine:
 
     def compileParameterList(self):
         # 參數列表不需產生 VM code，只需加入 Symbol Table
-        if self.tokenizer.tokenType() == 'SYMBOL' and self.tokenizer.symbol() == ')':
+        if self.tokenizer.value == S_RPAREN:
             return
 
         type = self._getCurrentType()
@@ -125,7 +138,7 @@ class CompilationEngine:
         self.symbol_table.define(name, type, 'ARG')
         self.tokenizer.advance()
         
-        while self.tokenizer.tokenType() == 'SYMBOL' and self.tokenizer.symbol() == ',':
+        while self.tokenizer.value == S_COMMA:
             self.tokenizer.advance()
             type = self._getCurrentType()
             self.tokenizer.advance()
@@ -142,7 +155,7 @@ class CompilationEngine:
         self.symbol_table.define(name, type, 'VAR')
         self.tokenizer.advance()
         
-        while self.tokenizer.tokenType() == 'SYMBOL' and self.tokenizer.symbol() == ',':
+        while self.tokenizer.value == S_COMMA:
             self.tokenizer.advance()
             name = self.tokenizer.identifier()
             self.symbol_table.define(name, type, 'VAR')
@@ -151,13 +164,13 @@ class CompilationEngine:
         self.tokenizer.advance() # ;
 
     def compileStatements(self):
-        while self.tokenizer.tokenType() == 'KEYWORD':
-            kw = self.tokenizer.keyWord()
-            if kw == 'LET': self.compileLet()
-            elif kw == 'IF': self.compileIf()
-            elif kw == 'WHILE': self.compileWhile()
-            elif kw == 'DO': self.compileDo()
-            elif kw == 'RETURN': self.compileReturn()
+        while True:
+            kw = self.tokenizer.value
+            if kw == K_LET: self.compileLet()
+            elif kw == K_IF: self.compileIf()
+            elif kw == K_WHILE: self.compileWhile()
+            elif kw == K_DO: self.compileDo()
+            elif kw == K_RETURN: self.compileReturn()
             else: break
 
     def compileLet(self):
@@ -170,7 +183,7 @@ class CompilationEngine:
         isArray = False
         
         # 判斷是否為陣列賦值
-        if self.tokenizer.tokenType() == 'SYMBOL' and self.tokenizer.symbol() == '[':
+        if self.tokenizer.value == S_LBRACKET:
             isArray = True
             
             # 1. Push 陣列基底
@@ -215,9 +228,9 @@ class CompilationEngine:
         # 結構: term (op term)*
         self.compileTerm()
         
-        ops = {'+', '-', '*', '/', '&', '|', '<', '>', '='}
-        while self.tokenizer.tokenType() == 'SYMBOL' and self.tokenizer.symbol() in ops:
-            op = self.tokenizer.symbol() # 記住運算子
+        ops = self.BINARY_OPS
+        while self.tokenizer.value in ops:
+            op = self.tokenizer.value # 記住運算子
             self.tokenizer.advance()
             
             self.compileTerm() # 編譯右邊的 term
@@ -226,13 +239,13 @@ class CompilationEngine:
             self._write_op(op)
 
     def compileTerm(self):
-        type = self.tokenizer.tokenType()
+        type = self.tokenizer.kind
         
-        if type == 'INT_CONST':
+        if type == INT_CONST:
             self.vm_writer.write_push('CONST', self.tokenizer.intVal())
             self.tokenizer.advance()
             
-        elif type == 'STRING_CONST':
+        elif type == STRING_CONST:
             # --- [新增] 字串處理 ---
             s = self.tokenizer.stringVal()
             self.vm_writer.write_push('CONST', len(s))
@@ -242,24 +255,24 @@ class CompilationEngine:
                 self.vm_writer.write_call('String.appendChar', 2)
             self.tokenizer.advance()
             
-        elif type == 'KEYWORD':
-            kw = self.tokenizer.keyWord()
-            if kw == 'TRUE':
+        elif type == KEYWORD:
+            kw = self.tokenizer.value
+            if kw == K_TRUE:
                 self.vm_writer.write_push('CONST', 0)
                 self.vm_writer.write_arithmetic('NOT')
-            elif kw == 'FALSE' or kw == 'NULL':
+            elif kw == K_FALSE or kw == K_NULL:
                 self.vm_writer.write_push('CONST', 0)
-            elif kw == 'THIS':
+            elif kw == K_THIS:
                 self.vm_writer.write_push('POINTER', 0)
             self.tokenizer.advance()
 
-        elif type == 'IDENTIFIER':
+        elif type == IDENTIFIER:
             name = self.tokenizer.identifier()
             self.tokenizer.advance()
             
             # --- [修改] 判斷是 陣列存取 / 函式呼叫 / 普通變數 ---
             
-            if self.tokenizer.tokenType() == 'SYMBOL' and self.tokenizer.symbol() == '[':
+            if self.tokenizer.value == S_LBRACKET:
                 # 情況 A: 陣列存取 arr[i]
                 
                 # 1. Push 陣列基底位址
@@ -282,7 +295,7 @@ class CompilationEngine:
                 # 5. 取出值
                 self.vm_writer.write_push('THAT', 0)
                 
-            elif self.tokenizer.tokenType() == 'SYMBOL' and self.tokenizer.symbol() in ['(', '.']:
+            elif self.tokenizer.value == S_LPAREN or self.tokenizer.value == S_DOT:
                 # 情況 B: 函式呼叫 foo() 或 obj.method()
                 self._compileSubroutineCall(name)
             else:
@@ -292,17 +305,17 @@ class CompilationEngine:
                 segment = self._kind_to_segment(kind)
                 self.vm_writer.write_push(segment, index)
                 
-        elif type == 'SYMBOL' and self.tokenizer.symbol() == '(':
+        elif type == SYMBOL and self.tokenizer.value == S_LPAREN:
             self.tokenizer.advance()
             self.compileExpression()
             self.tokenizer.advance()
             
-        elif type == 'SYMBOL' and self.tokenizer.symbol() in ['-', '~']:
-            op = self.tokenizer.symbol()
+        elif type == SYMBOL and (self.tokenizer.value == S_MINUS or self.tokenizer.value == S_NOT):
+            op = self.tokenizer.value
             self.tokenizer.advance()
             self.compileTerm()
-            if op == '-': self.vm_writer.write_arithmetic('NEG')
-            if op == '~': self.vm_writer.write_arithmetic('NOT')
+            if op == S_MINUS: self.vm_writer.write_arithmetic('NEG')
+            if op == S_NOT: self.vm_writer.write_arithmetic('NOT')
 
     def compileDo(self):
         self.tokenizer.advance() # do
@@ -315,7 +328,7 @@ class CompilationEngine:
 
     def compileReturn(self):
         self.tokenizer.advance() # return
-        if self.tokenizer.tokenType() == 'SYMBOL' and self.tokenizer.symbol() == ';':
+        if self.tokenizer.value == S_SEMICOLON:
             self.vm_writer.write_push('CONST', 0) # Void returns 0
         else:
             self.compileExpression()
@@ -332,7 +345,7 @@ class CompilationEngine:
         # 處理 functionName() 或 ClassName.func() 或 var.method()
         n_args = 0
         
-        if self.tokenizer.symbol() == '.':
+        if self.tokenizer.value == S_DOT:
             self.tokenizer.advance() # .
             method_name = self.tokenizer.identifier()
             self.tokenizer.advance() # method name
@@ -348,7 +361,7 @@ class CompilationEngine:
             else: # 它是類別 (例如 Output.printInt()) -> 這是 Function
                 func_name = f"{first_name}.{method_name}"
                 
-        elif self.tokenizer.symbol() == '(': # method() -> 隱含 this.method()
+        elif self.tokenizer.value == S_LPAREN: # method() -> 隱含 this.method()
             func_name = f"{self.class_name}.{first_name}"
             self.vm_writer.write_push('POINTER', 0) # push this
             n_args = 1
@@ -361,12 +374,12 @@ class CompilationEngine:
 
     def compileExpressionList(self):
         count = 0
-        if self.tokenizer.tokenType() == 'SYMBOL' and self.tokenizer.symbol() == ')':
+        if self.tokenizer.value == S_RPAREN:
             return 0
             
         self.compileExpression()
         count += 1
-        while self.tokenizer.tokenType() == 'SYMBOL' and self.tokenizer.symbol() == ',':
+        while self.tokenizer.value == S_COMMA:
             self.tokenizer.advance()
             self.compileExpression()
             count += 1
@@ -389,20 +402,14 @@ class CompilationEngine:
         
     def _getCurrentType(self):
         # 輔助：回傳目前的型別字串，不管是 int, char 還是 class name
-        if self.tokenizer.tokenType() == 'KEYWORD':
-            return self.tokenizer.keyWord().lower() # int, boolean...
-        return self.tokenizer.identifier()
+        return self.tokenizer.text()
         
     def _write_op(self, op):
-        if op == '+': self.vm_writer.write_arithmetic('ADD')
-        elif op == '-': self.vm_writer.write_arithmetic('SUB')
-        elif op == '*': self.vm_writer.write_call('Math.multiply', 2)
-        elif op == '/': self.vm_writer.write_call('Math.divide', 2)
-        elif op == '&': self.vm_writer.write_arithmetic('AND')
-        elif op == '|': self.vm_writer.write_arithmetic('OR')
-        elif op == '<': self.vm_writer.write_arithmetic('LT')
-        elif op == '>': self.vm_writer.write_arithmetic('GT')
-        elif op == '=': self.vm_writer.write_arithmetic('EQ')
+        command = self.ARITHMETIC_OPS.get(op)
+        if command is not None:
+            self.vm_writer.write_arithmetic(command)
+        else:
+            self.vm_writer.write_call(self.CALL_OPS[op], 2)
 
     def compileIf(self):
         # 結構: if (expression) { statements } (else { statements })?
@@ -434,7 +441,7 @@ class CompilationEngine:
         self.vm_writer.write_label(L1)
         
         # 檢查有沒有 Else
-        if self.tokenizer.tokenType() == 'KEYWORD' and self.tokenizer.keyWord() == 'ELSE':
+        if self.tokenizer.value == K_ELSE:
             self.tokenizer.advance() # 吃掉 'else'
             self.tokenizer.advance() # 吃掉 '{'
             self.compileStatements()
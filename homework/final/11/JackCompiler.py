@@ -1,47 +1,106 @@
-import sys
+import io
 import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 # 假設你的模組分別存成這些檔案
 from JackTokenizer import JackTokenizer
 from CompilationEngine import CompilationEngine
+from BuildCache import BuildCache
 
-def compile_file(input_filename):
-    """編譯單一 .jack 檔案"""
+def compile_source(input_filename):
+    """
+    編譯單一 .jack 檔案但不寫檔，回傳 (輸出檔名, VM 程式碼, 錯誤訊息)。
+    每個 class 各自編譯 (CompilationEngine 的狀態只屬於一個檔案)，所以可以丟到別的 process 執行；
+    編譯失敗時 VM 程式碼是 None，錯誤訊息交給呼叫端統一回報。
+    """
     output_filename = input_filename.replace('.jack', '.vm')
-    
-    print(f"Compiling: {input_filename} -> {output_filename}")
-    
-    # 1. 建立 Tokenizer (讀取輸入)
-    tokenizer = JackTokenizer(input_filename)
-    
-    # 2. 準備輸出檔案 (寫入 .vm)
-    with open(output_filename, 'w') as output_file:
-        # 3. 建立 CompilationEngine (核心邏輯)
-        # 注意：你需要修改 CompilationEngine 讓它接受 output_file 或直接接受 VMWriter
+    output_file = io.StringIO()
+    try:
+        # 1. 建立 Tokenizer (讀取輸入)
+        tokenizer = JackTokenizer(input_filename)
+        # 2. 建立 CompilationEngine (核心邏輯)，VM 程式碼先寫進記憶體
         engine = CompilationEngine(tokenizer, output_file)
-        
-        # 4. 開始編譯 Class (這是入口點)
+        # 3. 開始編譯 Class (這是入口點)
         engine.compileClass()
+    except Exception as error:
+        return output_filename, None, f"{type(error).__name__}: {error}"
+    return output_filename, output_file.getvalue(), None
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python JackCompiler.py <file.jack or directory>")
-        return
+def write_result(input_filename, output_filename, vm_code, error):
+    """印出一個檔案的編譯結果並寫出 .vm；失敗時回傳 False"""
+    if error is not None:
+        print(f"Error: {input_filename}: {error}")
+        return False
+    print(f"Compiling: {input_filename} -> {output_filename}")
+    with open(output_filename, 'w') as output_file:
+        output_file.write(vm_code)
+    return True
 
-    path = sys.argv[1]
+def compile_file(input_filename):
+    """編譯單一 .jack 檔案"""
+    return write_result(input_filename, *compile_source(input_filename))
 
-    # 情況 A: 使用者輸入的是資料夾 (例如: python JackCompiler.py ./Seven)
+def collect_jack_files(path):
+    """目錄 -> 底下所有 .jack (依檔名排序，輸出順序固定)；單一 .jack 檔 -> 自己；其他 -> 空列表"""
     if os.path.isdir(path):
-        for filename in os.listdir(path):
-            if filename.endswith(".jack"):
-                full_path = os.path.join(path, filename)
-                compile_file(full_path)
-                
-    # 情況 B: 使用者輸入的是單一檔案 (例如: python JackCompiler.py Main.jack)
-    elif os.path.isfile(path) and path.endswith(".jack"):
-        compile_file(path)
-        
-    else:
+        return [os.path.join(path, filename) for filename in sorted(os.listdir(path))
+                if filename.endswith(".jack")]
+    if os.path.isfile(path) and path.endswith(".jack"):
+        return [path]
+    return []
+
+def compile_sources(jack_files, jobs):
+    """編譯一批檔案 (jobs > 1 時用 process pool)，依輸入順序回傳 compile_source 的結果"""
+    if jobs > 1 and len(jack_files) > 1:
+        # 每個 class 彼此獨立：worker 只回傳 VM 程式碼與錯誤訊息，寫檔與輸出訊息都由呼叫端依檔名順序處理
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            chunksize = max(1, len(jack_files) // (jobs * 4))
+            return list(executor.map(compile_source, jack_files, chunksize=chunksize))
+    return [compile_source(jack_file) for jack_file in jack_files]
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Jack Compiler")
+    arg_parser.add_argument("path", help="file.jack 或包含 .jack 的目錄")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=1,
+                            help="用幾個 process 平行編譯目錄裡的檔案 (預設 1，不開 process pool)")
+    arg_parser.add_argument("--cache", nargs="?", const="", default=None, metavar="DIR",
+                            help="增量編譯：內容沒變的 class 不重新編譯 (預設快取放在輸入旁的 .jackcache)")
+    args = arg_parser.parse_args()
+
+    # 情況 A: 資料夾 (例如: python JackCompiler.py ./Seven)；情況 B: 單一檔案 (例如: python JackCompiler.py Main.jack)
+    jack_files = collect_jack_files(args.path)
+    if not jack_files:
         print("Invalid file or directory.")
+        return
+
+    start = time.perf_counter()
+    cache = None
+    if args.cache is None:
+        pending = jack_files
+    else:
+        base_dir = args.path if os.path.isdir(args.path) else os.path.dirname(args.path)
+        cache = BuildCache(args.cache or os.path.join(base_dir, '.jackcache'))
+        cache.prune()
+        pending = cache.stale_files(jack_files)
+
+    failed = 0
+    for jack_file, result in zip(pending, compile_sources(pending, args.jobs)):
+        if not write_result(jack_file, *result):
+            failed += 1
+            if cache is not None:
+                cache.forget(jack_file)
+        elif cache is not None:
+            cache.update(jack_file)
+    if cache is not None:
+        cache.save()
+
+    elapsed = (time.perf_counter() - start) * 1000
+    up_to_date = f", {len(jack_files) - len(pending)} up to date" if cache is not None else ""
+    print(f"Compiled {len(pending) - failed}/{len(jack_files)} files{up_to_date} in {elapsed:.1f} ms")
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
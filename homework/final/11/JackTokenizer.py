@@ -1,93 +1,184 @@
+import os
 import re
+import sys
+import time
+from array import array
+
+# token 種類 (kind)，存在 array('B') 裡
+KEYWORD, SYMBOL, IDENTIFIER, INT_CONST, STRING_CONST = range(5)
+TOKEN_TYPES = ('KEYWORD', 'SYMBOL', 'IDENTIFIER', 'INT_CONST', 'STRING_CONST')
+
+# 關鍵字與符號的值編號是固定的小整數 (預先放進字串表的最前面)，CompilationEngine 直接比對這些整數
+(K_CLASS, K_CONSTRUCTOR, K_FUNCTION, K_METHOD, K_FIELD, K_STATIC, K_VAR,
+ K_INT, K_CHAR, K_BOOLEAN, K_VOID, K_TRUE, K_FALSE, K_NULL, K_THIS,
+ K_LET, K_DO, K_IF, K_ELSE, K_WHILE, K_RETURN) = range(21)
+KEYWORD_NAMES = ('class', 'constructor', 'function', 'method', 'field', 'static', 'var',
+                 'int', 'char', 'boolean', 'void', 'true', 'false', 'null', 'this',
+                 'let', 'do', 'if', 'else', 'while', 'return')
+
+(S_LBRACE, S_RBRACE, S_LPAREN, S_RPAREN, S_LBRACKET, S_RBRACKET, S_DOT, S_COMMA, S_SEMICOLON,
+ S_PLUS, S_MINUS, S_STAR, S_SLASH, S_AND, S_OR, S_LT, S_GT, S_EQ, S_NOT) = range(21, 40)
+SYMBOL_CHARS = '{}()[].,;+-*/&|<>=~'
 
 class JackTokenizer:
     # Jack 語言的關鍵字列表
-    KEYWORDS = {
-        'class', 'constructor', 'function', 'method', 'field', 'static', 'var',
-        'int', 'char', 'boolean', 'void', 'true', 'false', 'null', 'this',
-        'let', 'do', 'if', 'else', 'while', 'return'
-    }
-    
+    KEYWORDS = set(KEYWORD_NAMES)
+
     # 符號集合
-    SYMBOLS = {'{', '}', '(', ')', '[', ']', '.', ',', ';', '+', '-', '*', '/', '&', '|', '<', '>', '=', '~'}
-    
+    SYMBOLS = set(SYMBOL_CHARS)
+
     # XML 轉義對照表 (第11章其實用不到，但留著無妨)
     XML_ENTITY = {'<': '&lt;', '>': '&gt;', '"': '&quot;', '&': '&amp;'}
 
+    # master regex：同時處理註解與所有 token 類型 (註解放最前面，才不會被當成 '/' 符號)。
+    # 在類別層級編譯一次，同一個 process 裡所有檔案共用，不用每建一個 tokenizer 就重組一次
+    # 關鍵字：用 (?!\w) 確保不會匹配到變數的前綴 (如 classVar)
+    MASTER_REGEX = re.compile('|'.join([
+        r'(?P<COMMENT>//[^\n]*|/\*.*?\*/)',
+        r'(?P<OPEN_COMMENT>/\*)', # 區塊註解在這一段裡還沒結束
+        r'(?P<STRING_CONST>"[^"\n]*")',
+        r'(?P<KEYWORD>(?:' + '|'.join(re.escape(k) for k in sorted(KEYWORDS)) + r')(?!\w))',
+        r'(?P<SYMBOL>[' + re.escape(''.join(sorted(SYMBOLS))) + r'])',
+        r'(?P<INT_CONST>\d+)',
+        r'(?P<IDENTIFIER>[a-zA-Z_]\w*)',
+    ]), re.DOTALL)
+
+    GROUP_KINDS = {'KEYWORD': KEYWORD, 'SYMBOL': SYMBOL, 'IDENTIFIER': IDENTIFIER,
+                   'INT_CONST': INT_CONST, 'STRING_CONST': STRING_CONST}
+
+    # 字串表 (整個 process 共用)：值編號 -> 文字，以及 原始文字 -> 值編號。
+    # 字串常數的 key 含引號，所以只有關鍵字 / 符號本身會拿到 0~39 的編號，比對值編號就不用再看種類
+    VALUES = list(KEYWORD_NAMES) + list(SYMBOL_CHARS)
+    VALUE_IDS = {text: value_id for value_id, text in enumerate(VALUES)}
+
+    # 已經用掉的 token 超過這個數量就從 array 前面刪掉，記憶體不隨檔案大小成長
+    COMPACT_SIZE = 4096
+
     def __init__(self, input_file):
+        # 不再一次讀完整個檔案：token 由 generator 逐行掃描，需要時才讀下一行，
+        # 記憶體只跟「一行 + 跨行的區塊註解」有關，第一個 token 馬上就能拿到。
+        # token 存成兩個平行的 array：種類 (kinds) 與字串表的值編號 (values)，不建立 tuple 也不複製字串
+        self.kinds = array('B')
+        self.values = array('I')
+        self.position = -1 # 目前 token 在 array 裡的位置 (還沒 advance 過是 -1)
+        self.kind = None   # 目前 token 的種類 (KEYWORD, SYMBOL...)
+        self.value = None  # 目前 token 的值編號 (關鍵字是 K_*、符號是 S_*)
+        self.stream = self._tokenize(input_file)
+
+    def _tokenize(self, input_file):
+        """逐行掃描，把這一行的 token 加進 kinds / values 後 yield 一次；跨行的區塊註解會把後面幾行接起來再繼續掃"""
+        search = self.MASTER_REGEX.search
+        group_kinds = self.GROUP_KINDS
+        texts, value_ids = self.VALUES, self.VALUE_IDS
+        kinds, values = self.kinds, self.values
         with open(input_file, 'r') as f:
-            content = f.read()
-        
-        self.tokens = self._tokenize(content)
-        self.current_token_idx = 0
-        self.current_token = None # (Type, Value)
-
-    def _tokenize(self, content):
-        # 1. 移除註解
-        # 修正：改成 /\*.*?\*/ 以同時匹配 /** doc */ 和 /* block comment */
-        content = re.sub(r'/\*.*?\*/', ' ', content, flags=re.DOTALL) 
-        content = re.sub(r'//.*', ' ', content)
-        
-        # 2. Regex 定義
-        kws = '|'.join(re.escape(k) for k in self.KEYWORDS)
-        keyword_regex = r'(?P<KEYWORD>(' + kws + r')(?!\w))'
-        
-        symbol_regex = r'(?P<SYMBOL>[' + re.escape(''.join(self.SYMBOLS)) + r'])'
-        int_regex = r'(?P<INT_CONST>\d+)'
-        string_regex = r'(?P<STRING_CONST>"[^"\n]*")'
-        id_regex = r'(?P<IDENTIFIER>[a-zA-Z_]\w*)'
-
-        regex = '|'.join([keyword_regex, symbol_regex, int_regex, string_regex, id_regex])
-        
-        tokens = []
-        for match in re.finditer(regex, content):
-            if match.lastgroup:
-                token_type = match.lastgroup
-                token_val = match.group(token_type)
-                
-                if token_type == 'STRING_CONST':
-                    tokens.append(('STRING_CONST', token_val[1:-1]))
-                elif token_type == 'INT_CONST':
-                    tokens.append(('INT_CONST', token_val))
-                elif token_type == 'KEYWORD':
-                    tokens.append(('KEYWORD', token_val))
-                else:
-                    tokens.append((token_type, token_val))
-                    
-        return tokens
+            for chunk in f:
+                position = 0
+                while True:
+                    match = search(chunk, position)
+                    if match is None:
+                        break
+                    token_type = match.lastgroup
+                    if token_type == 'OPEN_COMMENT':
+                        # 讀到註解結束為止，從 /* 開始重新掃描這一段
+                        chunk = chunk[match.start():]
+                        for line in f:
+                            chunk += line
+                            if '*/' in line:
+                                break
+                        else:
+                            return # 註解沒有結束就到檔尾了
+                        position = 0
+                        continue
+                    position = match.end()
+                    if token_type == 'COMMENT':
+                        continue
+                    key = match.group()
+                    value_id = value_ids.get(key)
+                    if value_id is None:
+                        value_id = value_ids[key] = len(texts)
+                        # 去除字串前後的引號: "Hello" -> Hello
+                        texts.append(key[1:-1] if token_type == 'STRING_CONST' else key)
+                    kinds.append(group_kinds[token_type])
+                    values.append(value_id)
+                yield
+
+    def _fill(self, count):
+        """確保目前位置之後至少還有 count 個 token；檔案結束時回傳 False"""
+        while len(self.kinds) - self.position <= count:
+            if next(self.stream, False) is False:
+                return False
+        return True
 
     def hasMoreTokens(self):
-        return self.current_token_idx < len(self.tokens)
+        return self._fill(1)
 
     def advance(self):
-        if self.hasMoreTokens():
-            self.current_token = self.tokens[self.current_token_idx]
-            self.current_token_idx += 1
+        if self._fill(1):
+            position = self.position + 1
+            if position >= self.COMPACT_SIZE:
+                del self.kinds[:position]
+                del self.values[:position]
+                position = 0
+            self.position = position
+            self.kind = self.kinds[position]
+            self.value = self.values[position]
 
     # --- API 方法 (注意命名與回傳值) ---
+    # CompilationEngine 直接比對 self.kind / self.value 兩個整數；以下字串 API 留給需要文字的地方
+
+    def text(self):
+        """目前 token 的文字 (字串常數不含引號)"""
+        return self.VALUES[self.value]
 
     def tokenType(self):
-        return self.current_token[0]
+        return TOKEN_TYPES[self.kind]
 
     # 重要修正：改為 camelCase 並回傳大寫，以符合 CompilationEngine 的判斷
     def keyWord(self):
-        if self.current_token[0] == 'KEYWORD':
-            return self.current_token[1].upper() # 轉成大寫！
-        return self.current_token[1]
+        if self.kind == KEYWORD:
+            return self.VALUES[self.value].upper() # 轉成大寫！
+        return self.VALUES[self.value]
 
     def symbol(self):
-        return self.current_token[1]
+        return self.VALUES[self.value]
 
     def identifier(self):
-        return self.current_token[1]
+        return self.VALUES[self.value]
 
     def intVal(self):
-        return self.current_token[1]
+        return self.VALUES[self.value]
 
     def stringVal(self):
-        return self.current_token[1]
-    
+        return self.VALUES[self.value]
+
     def peek(self):
-        if self.current_token_idx < len(self.tokens):
-            return self.tokens[self.current_token_idx]
-        return None
\ No newline at end of file
+        if self._fill(1):
+            position = self.position + 1
+            return (TOKEN_TYPES[self.kinds[position]], self.VALUES[self.values[position]])
+        return None
+
+def benchmark(path, repeat=20):
+    """
+    量測 tokenizer 吞吐量：path 可以是單一 .jack 或目錄 (目錄下每個檔案各建一個 JackTokenizer)。
+    重複 repeat 次，回傳 (檔案數, token 數, 秒數)。
+    """
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.jack'))
+    else:
+        files = [path]
+    count = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for jack_file in files:
+            tokenizer = JackTokenizer(jack_file)
+            for _ in tokenizer.stream:
+                pass
+            count += len(tokenizer.kinds)
+    return len(files), count, time.perf_counter() - start
+
+if __name__ == "__main__":
+    # 用法：python JackTokenizer.py <file.jack 或目錄> ...
+    for path in sys.argv[1:]:
+        files, count, elapsed = benchmark(path)
+        print(f"{path}: {files} files, {count} tokens in {elapsed * 1000:.1f} ms ({count / elapsed:,.0f} tokens/s)")
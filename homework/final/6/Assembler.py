@@ -1,43 +1,55 @@
+import os
 import sys
+import glob
+import json
+import mmap
+import hashlib
+import time
+import argparse
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from Peephole import PeepholeOptimizer
+from array import array
+from types import MappingProxyType
+
+def clean_lines(lines):
+    """
+    逐行去除註解 (// 之後) 與前後空白，跳過空行，產生 (行號, 指令) 配對。
+    是 generator，單遍串流組譯可以邊讀邊處理；行號從 1 開始，方便回報錯誤。
+    """
+    for line_number, raw_line in enumerate(lines, 1):
+        instruction = raw_line.split('//')[0].strip()
+        if instruction:
+            yield line_number, instruction
+
+def read_instructions(filename):
+    """一次讀完檔案並預先過濾，只保留 (行號, 指令) 配對"""
+    with open(filename, 'r') as f:
+        return list(clean_lines(f))
 
 class Parser:
     """
     負責讀取 .asm 檔案，並將每一行拆解成指令單元。
     """
     def __init__(self, filename):
-        # 這裡建議一次把所有行讀進來並做初步清理（去掉空白、換行）
-        with open(filename, 'r') as f:
-            self.lines = f.readlines()
+        # 一次把所有行讀進來並做初步清理：註解、空白與空行都在這裡濾掉
+        self.instructions = read_instructions(filename)
         
         self.current_instruction = ""
+        self.current_line_number = 0
         self.current_line_idx = -1
 
     def has_more_lines(self):
         """檢查是否還有下一行指令"""
-        return self.current_line_idx < len(self.lines) - 1
+        return self.current_line_idx < len(self.instructions) - 1
 
     def advance(self):
         """
-        讀取下一行，並跳過空行和註解。
-        目標是讓 self.current_instruction 變成一條乾淨的指令。
+        讀取下一條指令。空行和註解已經在 read_instructions 濾掉了，
+        不需要再遞迴跳過，長串的註解也不會吃掉 stack。
         """
         self.current_line_idx += 1
-        raw_line = self.lines[self.current_line_idx]
-        
-        # TODO: 1. 去除註解 (// 之後的內容)
-        clean_line = raw_line.split('//')[0]
-        # TODO: 2. 去除前後空白 (.strip())
-        clean_line = clean_line.strip()
-        # TODO: 3. 如果是空行，遞迴呼叫 self.advance() 直到找到有效指令或檔案結束
-        if clean_line == "":
-            if self.has_more_lines():
-                self.advance()
-            else:
-                self.current_instruction = ""
-        else:
-            self.current_instruction = clean_line
-        
-        # self.current_instruction = clean_line 
+        self.current_line_number, self.current_instruction = self.instructions[self.current_line_idx]
 
     def instruction_type(self):
         """
@@ -94,119 +106,232 @@ class Parser:
 class Code:
     """
     提供靜態方法，將組合語言的助記符 (Mnemonic) 轉為二進位碼。
+    對照表在 import 時建立一次，之後每次查詢都直接共用。
     """
-    
+
+    DEST_TABLE = {
+        'null': '000',
+        'M': '001',
+        'D': '010',
+        'MD': '011',
+        'A': '100',
+        'AM': '101',
+        'AD': '110',
+        'AMD': '111'
+    }
+
+    # 注意：需要處理 a=0 和 a=1 的情況
+    # 例如: 'D+1' -> a=0, '011111'
+    #       'M+1' -> a=1, '111111'
+    COMP_TABLE = {
+        # a = 0 (使用 A 暫存器)
+        '0':   '0101010',
+        '1':   '0111111',
+        '-1':  '0111010',
+        'D':   '0001100',
+        'A':   '0110000',
+        '!D':  '0001101',
+        '!A':  '0110001',
+        '-D':  '0001111',
+        '-A':  '0110011',
+        'D+1': '0011111',
+        'A+1': '0110111',
+        'D-1': '0001110',
+        'A-1': '0110010',
+        'D+A': '0000010',
+        'D-A': '0010011',
+        'A-D': '0000111',
+        'D&A': '0000000',
+        'D|A': '0010101',
+
+        # a = 1 (使用 Memory，也就是把上面 A 的部分換成 M)
+        'M':   '1110000',
+        '!M':  '1110001',
+        '-M':  '1110011',
+        'M+1': '1110111',
+        'M-1': '1110010',
+        'D+M': '1000010',
+        'D-M': '1010011',
+        'M-D': '1000111',
+        'D&M': '1000000',
+        'D|M': '1010101',
+
+        # 交換律的寫法 (例如 VM 轉譯器產生的 A=M+D)，編碼和上面相同
+        'A+D': '0000010',
+        'A&D': '0000000',
+        'A|D': '0010101',
+        'M+D': '1000010',
+        'M&D': '1000000',
+        'M|D': '1010101'
+    }
+
+    JUMP_TABLE = {
+        'null': '000',
+        'JGT': '001',
+        'JEQ': '010',
+        'JGE': '011',
+        'JLT': '100',
+        'JNE': '101',
+        'JLE': '110',
+        'JMP': '111'
+    }
+
     @staticmethod
     def dest(mnemonic):
         """回傳 3 bits 的 dest 二進位碼"""
-        # TODO: 建立字典對照表 (e.g., 'D': '010')
-        # return table.get(mnemonic, '000')
-        table = {
-            'null': '000',
-            'M': '001',
-            'D': '010',
-            'MD': '011',
-            'A': '100',
-            'AM': '101',
-            'AD': '110',
-            'AMD': '111'
-        }
-        return table.get(mnemonic, '000')
+        return Code.DEST_TABLE.get(mnemonic, '000')
 
     @staticmethod
     def comp(mnemonic):
         """回傳 7 bits 的 comp 二進位碼 (包含 a-bit)"""
-        # 注意：你需要處理 a=0 和 a=1 的情況
-        # 例如: 'D+1' -> a=0, '011111'
-        #       'M+1' -> a=1, '111111'
-        table = {
-            # a = 0 (使用 A 暫存器)
-            '0':   '0101010',
-            '1':   '0111111',
-            '-1':  '0111010',
-            'D':   '0001100',
-            'A':   '0110000',
-            '!D':  '0001101',
-            '!A':  '0110001',
-            '-D':  '0001111',
-            '-A':  '0110011',
-            'D+1': '0011111',
-            'A+1': '0110111',
-            'D-1': '0001110',
-            'A-1': '0110010',
-            'D+A': '0000010',
-            'D-A': '0010011',
-            'A-D': '0000111',
-            'D&A': '0000000',
-            'D|A': '0010101',
-            
-            # a = 1 (使用 Memory，也就是把上面 A 的部分換成 M)
-            'M':   '1110000',
-            '!M':  '1110001',
-            '-M':  '1110011',
-            'M+1': '1110111',
-            'M-1': '1110010',
-            'D+M': '1000010',
-            'D-M': '1010011',
-            'M-D': '1000111',
-            'D&M': '1000000',
-            'D|M': '1010101'
-        }
-        return table.get(mnemonic, '0000000') # 若找不到回傳 0000000 避免當機
+        return Code.COMP_TABLE.get(mnemonic, '0000000') # 若找不到回傳 0000000 避免當機
 
     @staticmethod
     def jump(mnemonic):
         """回傳 3 bits 的 jump 二進位碼"""
-        # TODO: 建立字典對照表 (e.g., 'JMP': '111')
-        table = {
-            'null': '000',
-            'JGT': '001',
-            'JEQ': '010',
-            'JGE': '011',
-            'JLT': '100',
-            'JNE': '101',
-            'JLE': '110',
-            'JMP': '111'
-        }
-        return table.get(mnemonic, '000')
+        return Code.JUMP_TABLE.get(mnemonic, '000')
+
+def _predefined_symbols():
+    """預設符號 (R0~R15, SCREEN, KBD, SP, LCL, ARG, THIS, THAT)"""
+    table = {f'R{i}': i for i in range(16)}
+    table['SP'] = 0
+    table['LCL'] = 1
+    table['ARG'] = 2
+    table['THIS'] = 3
+    table['THAT'] = 4
+    table['SCREEN'] = 16384
+    table['KBD'] = 24576
+    return table
 
 class SymbolTable:
+    """
+    符號表分成三塊：
+    - PREDEFINED：預設符號，import 時建立一次、所有實例共用的唯讀 dict
+    - labels：使用者標籤 -> ROM 位址
+    - variables：變數 -> RAM 位址 (從 RAM[16] 開始依序分配)
+    同一個 process 組譯很多檔案時，不用每次重新填入預設符號。
+    """
+
+    PREDEFINED = MappingProxyType(_predefined_symbols())
+
     def __init__(self):
-        self.table = {}
-        # TODO: 初始化預設符號 (R0~R15, SCREEN, KBD, SP, LCL, ARG, THIS, THAT)
-        # 例如: self.table['R0'] = 0
-        #      self.table['SCREEN'] = 16384
-        for i in range(16):
-            self.table[f'R{i}'] = i
-        self.table['SP'] = 0
-        self.table['LCL'] = 1
-        self.table['ARG'] = 2
-        self.table['THIS'] = 3
-        self.table['THAT'] = 4
-        self.table['SCREEN'] = 16384
-        self.table['KBD'] = 24576
+        self.labels = {}
+        self.variables = {}
+        self.next_variable_address = 16
 
     def add_entry(self, symbol, address):
-        """新增一組 (symbol, address)"""
-        self.table[symbol] = address
+        """新增一組 (symbol, address)，視為標籤 (變數請用 add_variable)"""
+        self.labels[symbol] = address
+
+    def add_label(self, label, address):
+        """新增標籤，address 是 ROM 位址"""
+        self.labels[label] = address
+
+    def add_variable(self, symbol):
+        """把 symbol 當成新變數分配下一個 RAM 位址，回傳分配到的位址"""
+        address = self.next_variable_address
+        self.variables[symbol] = address
+        self.next_variable_address += 1
+        return address
 
     def contains(self, symbol):
         """檢查符號是否存在"""
-        return symbol in self.table
+        return symbol in self.PREDEFINED or symbol in self.labels or symbol in self.variables
 
     def get_address(self, symbol):
         """取得符號對應的位址"""
-        return self.table[symbol]
+        address = self.PREDEFINED.get(symbol)
+        if address is None:
+            address = self.labels.get(symbol)
+            if address is None:
+                address = self.variables[symbol]
+        return address
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python assembler.py Prog.asm")
-        return
+def write_symbol_map(symbol_table, output_file):
+    """
+    寫出符號對照檔 (name address)，給除錯器 / 模擬器使用。
+    標籤 (ROM) 與變數 (RAM) 分成兩段，預設符號不寫出。
+    """
+    with open(output_file, 'w') as f:
+        f.write("// labels (ROM)\n")
+        f.writelines(f"{name} {address}\n" for name, address in symbol_table.labels.items())
+        f.write("// variables (RAM)\n")
+        f.writelines(f"{name} {address}\n" for name, address in symbol_table.variables.items())
 
-    input_file = sys.argv[1]
-    output_file = input_file.replace('.asm', '.hack')
+def read_symbol_map(input_file):
+    """讀回 write_symbol_map 的檔案，回傳 (labels, variables) 兩個 dict"""
+    labels, variables = {}, {}
+    section = labels
+    with open(input_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('//'):
+                section = variables if 'variables' in line else labels
+            elif line:
+                name, address = line.rsplit(' ', 1)
+                section[name] = int(address)
+    return labels, variables
 
-    symbol_table = SymbolTable()
+def rom_line_numbers(instructions):
+    """(行號, 指令) 配對 -> 每個 ROM 位址對應的 .asm 行號 (標籤不佔位址)"""
+    return [line_number for line_number, instruction in instructions if instruction[0] != '(']
+
+def write_source_map(input_map, rom_lines, output_file):
+    """
+    把 VM 轉譯器的 source map (以 .asm 行號為準) 換算成以 ROM 位址為準，
+    每行 "ROM位址 檔名.vm 行號 函式名"，給 CPU 模擬器的 profiler 用。
+    rom_lines[i] 是 ROM 位址 i 來自的 .asm 行號；一段 VM 指令從第一個行號 >= 它起始行的位址開始。
+    同一個位址有多筆時 (例如 label 指令不產生機器碼) 只留最後一筆。
+    """
+    entries = {}
+    with open(input_map, 'r') as f:
+        for line in f:
+            if line.startswith('//') or not line.strip():
+                continue
+            asm_line, _, vm_file, vm_line, function_name = line.split()
+            address = bisect_left(rom_lines, int(asm_line))
+            if address < len(rom_lines):
+                entries[address] = (vm_file, vm_line, function_name)
+    with open(output_file, 'w') as f:
+        f.write("// rom_address vm_file vm_line function\n")
+        f.writelines(f"{address} {vm_file} {vm_line} {function_name}\n"
+                     for address, (vm_file, vm_line, function_name) in entries.items())
+
+def read_source_map(input_file):
+    """讀回 write_source_map 的檔案，回傳 (排序好的起始位址 list, 對應的 (檔名, 行號, 函式名) list)"""
+    addresses, sources = [], []
+    with open(input_file, 'r') as f:
+        for line in f:
+            if line.startswith('//') or not line.strip():
+                continue
+            address, vm_file, vm_line, function_name = line.split()
+            addresses.append(int(address))
+            sources.append((vm_file, int(vm_line), function_name))
+    return addresses, sources
+
+def _fill_stats(stats, first_pass_time, second_pass_time, a_count, c_count, l_count,
+                variables, distinct_c):
+    """把組譯過程的計時與計數填進 stats (--stats 用)"""
+    stats.update({
+        'first_pass_ms': first_pass_time * 1000,
+        'second_pass_ms': second_pass_time * 1000,
+        'a_instructions': a_count,
+        'c_instructions': c_count,
+        'l_instructions': l_count,
+        'variables': variables,
+        'distinct_c_instructions': distinct_c,
+    })
+
+def assemble_two_pass(input_file, stats=None, symbol_table=None):
+    """
+    標準兩遍掃描：第一遍建立標籤表，第二遍重新讀檔並翻譯。
+    回傳 array('H') 形式的機器碼；有給 stats (dict) 時會順便填入統計資料，
+    有給 symbol_table 時組譯結果的標籤與變數會留在裡面 (輸出符號對照檔用)。
+    """
+    start = time.perf_counter()
+    if symbol_table is None:
+        symbol_table = SymbolTable()
+    l_count = 0
 
     # ==========================================
     # 第一遍掃描 (First Pass): 建立符號表
@@ -222,8 +347,8 @@ def main():
             # TODO: 取得標籤名稱，加入 symbol_table，位址為目前的 rom_address
             # 注意：標籤本身不佔用 ROM 空間，所以 rom_address 不用加 1
             label = parser.symbol()
-            symbol_table.add_entry(label, rom_address)
-            pass
+            symbol_table.add_label(label, rom_address)
+            l_count += 1
         else:
             # A 指令或 C 指令都佔用 1 行 ROM
             rom_address += 1
@@ -231,11 +356,13 @@ def main():
     # ==========================================
     # 第二遍掃描 (Second Pass): 翻譯程式碼
     # ==========================================
+    first_pass_end = time.perf_counter()
     parser = Parser(input_file) # 重新建立 Parser 以從頭讀取
-    output_lines = []
+    words = array('H')
+    c_instructions = set()
+    a_count = 0
     
-    # 用來分配變數記憶體位址 (從 RAM[16] 開始)
-    variable_address = 16 
+    # 變數記憶體位址由 symbol_table 從 RAM[16] 開始分配
 
     while parser.has_more_lines():
         parser.advance()
@@ -246,42 +373,495 @@ def main():
             # TODO: 
             # 1. 如果 symbol 是數字 -> 直接轉二進位
             # 2. 如果 symbol 是符號 -> 查表
-            #    - 如果表裡沒有，視為新變數，存入表 (位址 = variable_address++)
+            #    - 如果表裡沒有，視為新變數，存入表 (位址由 add_variable 依序分配)
             # 3. 轉成 16-bit 二進位字串 (開頭補0)
             if symbol.isdigit():
                 address = int(symbol)
             else:
                 if not symbol_table.contains(symbol):
-                    symbol_table.add_entry(symbol, variable_address)
-                    variable_address += 1
+                    symbol_table.add_variable(symbol)
                 address = symbol_table.get_address(symbol)
-            binary_string = format(address, '016b')
-            output_lines.append(binary_string)
+            words.append(address)
+            a_count += 1
 
         elif instr_type == 'C_INSTRUCTION': # D=M+1
-            # TODO:
-            # 1. 呼叫 parser 取得 dest, comp, jump
-            # 2. 呼叫 Code 模組轉成二進位
-            # 3. 拼湊成 '111' + comp + dest + jump
-            dest_mnemonic = parser.dest()
-            comp_mnemonic = parser.comp()
-            jump_mnemonic = parser.jump()
-            binary_string = '111' + Code.comp(comp_mnemonic) + Code.dest(dest_mnemonic) + Code.jump(jump_mnemonic)
-            output_lines.append(binary_string)
+            # 整條指令查快取，等同 '111' + comp + dest + jump
+            words.append(encode_c_instruction(parser.current_instruction))
+            c_instructions.add(parser.current_instruction)
 
         elif instr_type == 'L_INSTRUCTION':
             # 第二遍掃描可以直接忽略標籤
             continue
-            
-        # 將翻譯好的二進位字串加入 output_lines
-        # output_lines.append(binary_string)
 
-    # 寫入檔案
+    if stats is not None:
+        _fill_stats(stats, first_pass_end - start, time.perf_counter() - first_pass_end,
+                    a_count, len(words) - a_count, l_count, len(symbol_table.variables),
+                    len(c_instructions))
+    return words
+
+# 整條 C 指令原文 -> 16-bit 機器碼
+# 編譯器產生的程式只有幾百種不同的 C 指令，卻重複出現上萬次，所以直接快取整條指令
+_c_instruction_cache = {}
+
+def encode_c_instruction(instruction):
+    """把一條 C 指令 (dest=comp;jump) 直接編碼成 16-bit 整數 (有快取)"""
+    word = _c_instruction_cache.get(instruction)
+    if word is None:
+        dest, comp, jump = "null", instruction, "null"
+        if '=' in comp:
+            dest, comp = comp.split('=', 1)
+        if ';' in comp:
+            comp, jump = comp.split(';', 1)
+        word = int('111' + Code.comp(comp) + Code.dest(dest) + Code.jump(jump), 2)
+        _c_instruction_cache[instruction] = word
+    return word
+
+def assemble_single_pass(input_file, stats=None, symbol_table=None):
+    """
+    單遍串流組譯：檔案只讀一次。
+    指令直接編碼進 array('H')，遇到還沒定義的符號就先填 0 並記下位置，
+    讀完整個檔案後再回填 (back-patch) 標籤位址，剩下沒定義的符號才當作變數。
+    回傳 array('H') 形式的機器碼；stats 的 first pass 是讀檔編碼、second pass 是回填。
+    """
+    start = time.perf_counter()
+    if symbol_table is None:
+        symbol_table = SymbolTable()
+    words = array('H')
+    c_instructions = set()
+    a_count = 0
+    l_count = 0
+    # 尚未解析的符號 -> 引用它的 ROM 位址列表 (dict 保留第一次出現的順序)
+    pending = {}
+
+    with open(input_file, 'r') as f:
+        for _, instruction in clean_lines(f):
+            if instruction[0] == '@':
+                a_count += 1
+                symbol = instruction[1:]
+                if symbol.isdigit():
+                    words.append(int(symbol))
+                elif symbol in pending:
+                    pending[symbol].append(len(words))
+                    words.append(0)
+                elif symbol_table.contains(symbol):
+                    words.append(symbol_table.get_address(symbol))
+                else:
+                    # 可能是後面才出現的標籤，也可能是變數，先留空
+                    pending[symbol] = [len(words)]
+                    words.append(0)
+            elif instruction[0] == '(' and instruction[-1] == ')':
+                symbol_table.add_label(instruction[1:-1], len(words))
+                l_count += 1
+            else:
+                words.append(encode_c_instruction(instruction))
+                c_instructions.add(instruction)
+
+    # 回填：標籤已經全部已知，其餘符號依第一次出現的順序從 RAM[16] 分配
+    first_pass_end = time.perf_counter()
+    for symbol, positions in pending.items():
+        if not symbol_table.contains(symbol):
+            symbol_table.add_variable(symbol)
+        address = symbol_table.get_address(symbol)
+        for position in positions:
+            words[position] = address
+
+    if stats is not None:
+        _fill_stats(stats, first_pass_end - start, time.perf_counter() - first_pass_end,
+                    a_count, len(words) - a_count, l_count, len(symbol_table.variables),
+                    len(c_instructions))
+    return words
+
+def assemble_optimized(input_file, stats=None, symbol_table=None, rom_lines=None):
+    """
+    解析後先經過窺孔優化 (PeepholeOptimizer) 再編碼。
+    變數位址依「原始程式」中第一次出現的順序分配，所以優化不會改變 RAM 配置；
+    標籤位址則在優化之後重新計算。
+    rom_lines 是 list 時，填入優化後每個 ROM 位址對應的原始 .asm 行號 (source map 用)。
+    回傳 (array('H') 機器碼, PeepholeOptimizer)。
+    """
+    start = time.perf_counter()
+    numbered = read_instructions(input_file)
+    instructions = [instruction for _, instruction in numbered]
+
+    # 原始程式的變數分配順序
+    labels = {instruction[1:-1] for instruction in instructions if instruction[0] == '('}
+    if symbol_table is None:
+        symbol_table = SymbolTable()
+    for instruction in instructions:
+        if instruction[0] == '@':
+            symbol = instruction[1:]
+            if not symbol.isdigit() and symbol not in labels and not symbol_table.contains(symbol):
+                symbol_table.add_variable(symbol)
+
+    optimizer = PeepholeOptimizer()
+    if rom_lines is None:
+        instructions = optimizer.optimize(instructions)
+    else:
+        instructions = optimizer.optimize(instructions, [line_number for line_number, _ in numbered])
+        rom_lines.extend(rom_line_numbers(zip(optimizer.line_numbers, instructions)))
+
+    # 優化後重新解析標籤 (l_count 是去掉的標籤行數，重複宣告的標籤每行都算)
+    rom_address = 0
+    l_count = 0
+    for instruction in instructions:
+        if instruction[0] == '(':
+            symbol_table.add_label(instruction[1:-1], rom_address)
+            l_count += 1
+        else:
+            rom_address += 1
+    first_pass_end = time.perf_counter()
+
+    code = [instruction for instruction in instructions if instruction[0] != '(']
+    words = _encode_chunk(code, symbol_table)
+
+    if stats is not None:
+        a_count = sum(1 for instruction in code if instruction[0] == '@')
+        _fill_stats(stats, first_pass_end - start, time.perf_counter() - first_pass_end,
+                    a_count, len(code) - a_count, l_count, len(symbol_table.variables),
+                    len({instruction for instruction in code if instruction[0] != '@'}))
+        stats['peephole_removed'] = optimizer.removed
+    return words, optimizer
+
+def write_hack(words, output_file):
+    """寫出 .hack 文字檔：每個 word 一行 16 個 '0'/'1' 字元"""
     with open(output_file, 'w') as f:
-        for line in output_lines:
-            f.write(line + '\n')
-    
-    print(f"Assembly completed! Output: {output_file}")
+        f.writelines(f"{word:016b}\n" for word in words)
+
+def write_binary(words, output_file, byteorder='little'):
+    """
+    寫出二進位 ROM 映像：每個 word 2 bytes，沒有任何檔頭，可以直接 mmap。
+    byteorder: 'little' 或 'big'
+    """
+    if byteorder != sys.byteorder:
+        words = array('H', words)
+        words.byteswap()
+    with open(output_file, 'wb') as f:
+        words.tofile(f)
+
+def load_binary(input_file, byteorder='little'):
+    """
+    讀回 write_binary 產生的 ROM 映像，回傳可以用索引存取的 16-bit words。
+    位元組順序和本機相同時直接 mmap 檔案並 cast 成 memoryview，不複製任何資料；
+    順序不同時才需要複製一份再 byteswap。
+    """
+    with open(input_file, 'rb') as f:
+        if byteorder != sys.byteorder:
+            words = array('H')
+            words.frombytes(f.read())
+            words.byteswap()
+            return words
+        try:
+            rom = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空檔案無法 mmap
+            return memoryview(array('H'))
+    return memoryview(rom).cast('H')
+
+# 快取格式有變動時遞增，舊的快取會自動失效
+CACHE_VERSION = 3
+
+def _split_chunks(lines):
+    """
+    清掉註解與空白後，以標籤為界把程式切成區塊。
+    回傳 [(label 或 None, [instruction, ...]), ...]；第一個區塊可能沒有標籤。
+    """
+    chunks = [(None, [])]
+    for _, instruction in clean_lines(lines):
+        if instruction[0] == '(' and instruction[-1] == ')':
+            chunks.append((instruction[1:-1], []))
+        else:
+            chunks[-1][1].append(instruction)
+    return chunks
+
+def _chunk_symbols(instructions):
+    """區塊內 A 指令引用到的符號 (依第一次出現的順序，不含數字)"""
+    symbols = {}
+    for instruction in instructions:
+        if instruction[0] == '@' and not instruction[1:].isdigit():
+            symbols[instruction[1:]] = None
+    return list(symbols)
+
+def _encode_chunk(instructions, symbol_table):
+    """在符號都已經決定好的情況下編碼一個區塊"""
+    words = array('H')
+    for instruction in instructions:
+        if instruction[0] == '@':
+            symbol = instruction[1:]
+            words.append(int(symbol) if symbol.isdigit() else symbol_table.get_address(symbol))
+        else:
+            words.append(encode_c_instruction(instruction))
+    return words
+
+def assemble_cached(input_file, cache_dir, stats=None, symbol_table=None):
+    """
+    有快取的組譯。快取檔放在 cache_dir，以 .asm 內容的 SHA-256 判斷是否變動：
+    - 內容完全沒變：不解析也不編碼，直接用快取的機器碼。
+    - 有變動：重跑第一遍 (建立 SymbolTable，記錄每個標籤的 ROM 位址)，
+      以標籤切出的區塊為單位比對，內容沒變且引用的符號位址也沒變的區塊直接沿用舊的機器碼，
+      只有修改過的區塊才重新編碼。
+    回傳 (array('H') 機器碼, 重新編碼的區塊數, 區塊總數)。
+    """
+    start = time.perf_counter()
+    with open(input_file, 'rb') as f:
+        content = f.read()
+    source_hash = hashlib.sha256(content).hexdigest()
+
+    # 檔名加上完整路徑的雜湊：共用 --cache DIR 時，不同目錄裡同名的 Main.asm 各有自己的快取檔
+    path_hash = hashlib.sha1(os.path.realpath(input_file).encode()).hexdigest()[:12]
+    cache_file = os.path.join(cache_dir, f"{os.path.basename(input_file)}.{path_hash}.json")
+    previous = None
+    if os.path.exists(cache_file):
+        with open(cache_file, 'r') as f:
+            previous = json.load(f)
+        if previous.get('version') != CACHE_VERSION:
+            previous = None
+
+    if symbol_table is None:
+        symbol_table = SymbolTable()
+
+    if previous and previous['source_hash'] == source_hash:
+        words = array('H', previous['words'])
+        symbol_table.labels.update(previous['labels'])
+        symbol_table.variables.update(previous['variables'])
+        if stats is not None:
+            _fill_stats(stats, time.perf_counter() - start, 0, *previous['counts'])
+        return words, 0, previous['chunk_count']
+
+    chunks = _split_chunks(content.decode().splitlines())
+
+    # ==========================================
+    # 第一遍：標籤位址 + 每個區塊的內容雜湊
+    # ==========================================
+    rom_address = 0
+    chunk_hashes = []
+    for label, instructions in chunks:
+        if label is not None:
+            symbol_table.add_label(label, rom_address)
+        rom_address += len(instructions)
+        chunk_hashes.append(hashlib.sha1('\n'.join(instructions).encode()).hexdigest())
+
+    old_chunks = previous['chunks'] if previous else {}
+    old_symbols = previous['symbols'] if previous else {}
+
+    # 依第一次出現的順序分配變數 (和兩遍掃描的結果一致)
+    # 沒變的區塊直接用快取記錄的符號列表，不用重新掃描
+    chunk_symbol_lists = []
+    for (label, instructions), chunk_hash in zip(chunks, chunk_hashes):
+        cached = old_chunks.get(chunk_hash)
+        symbols = cached['symbols'] if cached else _chunk_symbols(instructions)
+        chunk_symbol_lists.append(symbols)
+        for symbol in symbols:
+            if not symbol_table.contains(symbol):
+                symbol_table.add_variable(symbol)
+
+    # ==========================================
+    # 第二遍：只重新編碼有變動的區塊
+    # ==========================================
+    first_pass_end = time.perf_counter()
+    words = array('H')
+    new_chunks = {}
+    encoded = 0
+    for (label, instructions), chunk_hash, symbols in zip(chunks, chunk_hashes, chunk_symbol_lists):
+        cached = old_chunks.get(chunk_hash)
+        if cached and all(old_symbols.get(s) == symbol_table.get_address(s) for s in symbols):
+            chunk_words = array('H', cached['words'])
+        else:
+            chunk_words = _encode_chunk(instructions, symbol_table)
+            encoded += 1
+        words.extend(chunk_words)
+        new_chunks[chunk_hash] = {'symbols': symbols, 'words': chunk_words.tolist()}
+
+    # A/C/L 數量、變數數、不同 C 指令數 (也存進快取，命中時 --stats 照樣有資料)
+    a_count = sum(1 for _, instructions in chunks for i in instructions if i[0] == '@')
+    counts = [a_count, len(words) - a_count, len(chunks) - 1, len(symbol_table.variables),
+              len({i for _, instructions in chunks for i in instructions if i[0] != '@'})]
+    if stats is not None:
+        _fill_stats(stats, first_pass_end - start, time.perf_counter() - first_pass_end, *counts)
+
+    used_symbols = {s for symbols in chunk_symbol_lists for s in symbols}
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = cache_file + f'.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as f:
+        # json.dumps 走 C 實作的 encoder，比 json.dump 逐段寫檔快很多
+        f.write(json.dumps({
+            'version': CACHE_VERSION,
+            'source_hash': source_hash,
+            'symbols': {s: symbol_table.get_address(s) for s in used_symbols},
+            'labels': symbol_table.labels,
+            'variables': symbol_table.variables,
+            'chunk_count': len(chunks),
+            'counts': counts,
+            'chunks': new_chunks,
+            'words': words.tolist(),
+        }))
+    os.replace(tmp_file, cache_file)
+
+    return words, encoded, len(chunks)
+
+def assemble_file(input_file, single_pass=False, output_format="hack", byteorder="little",
+                  cache_dir=None, collect_stats=False, optimize=False, symbol_map=False, source_map=False):
+    """
+    組譯單一檔案並寫出結果。
+    cache_dir 不是 None 時使用 assemble_cached；空字串代表輸入檔旁邊的 .asmcache 目錄。
+    回傳 (輸出檔名, 指令數, 花費秒數, stats)，批次模式用來統計吞吐量；
+    collect_stats 為 False 時 stats 是 None；symbol_map 為 True 時另外寫出 .sym 符號對照檔。
+    source_map 為 True 且輸入檔旁有 VM 轉譯器寫的 .map 時，另外寫出以 ROM 位址為準的 .hack.map / .bin.map。
+    """
+    start = time.perf_counter()
+    stats = {'file': input_file} if collect_stats else None
+    symbol_table = SymbolTable()
+    input_map = input_file.replace('.asm', '.map')
+    source_map = source_map and os.path.exists(input_map)
+    rom_lines = [] if source_map else None
+
+    if optimize:
+        words, optimizer = assemble_optimized(input_file, stats, symbol_table, rom_lines)
+        print(f"{input_file}: {optimizer.report()}")
+        # 規則只刪 A/C 指令，所以不優化時的 ROM 大小 = 優化後 + 刪掉的指令數
+        print(f"{input_file}: ROM size {len(words) + optimizer.removed} -> {len(words)} instructions")
+    elif cache_dir is not None:
+        words, _, _ = assemble_cached(input_file, cache_dir or
+                                      os.path.join(os.path.dirname(input_file), '.asmcache'),
+                                      stats, symbol_table)
+    elif single_pass:
+        words = assemble_single_pass(input_file, stats, symbol_table)
+    else:
+        words = assemble_two_pass(input_file, stats, symbol_table)
+
+    write_start = time.perf_counter()
+
+    # 寫入檔案
+    if output_format == "bin":
+        output_file = input_file.replace('.asm', '.bin')
+        write_binary(words, output_file, byteorder)
+    else:
+        output_file = input_file.replace('.asm', '.hack')
+        write_hack(words, output_file)
+    if symbol_map:
+        write_symbol_map(symbol_table, input_file.replace('.asm', '.sym'))
+    if source_map:
+        if not optimize:
+            rom_lines = rom_line_numbers(read_instructions(input_file))
+        write_source_map(input_map, rom_lines, output_file + '.map')
+
+    end = time.perf_counter()
+    if stats is not None:
+        stats['write_ms'] = (end - write_start) * 1000
+        stats['instructions'] = len(words)
+    return output_file, len(words), end - start, stats
+
+def format_stats(stats):
+    """把一個檔案的 stats 轉成給人看的文字"""
+    return "\n".join([
+        f"Stats for {stats['file']}:",
+        f"  first pass:              {stats['first_pass_ms']:10.2f} ms",
+        f"  second pass:             {stats['second_pass_ms']:10.2f} ms",
+        f"  write:                   {stats['write_ms']:10.2f} ms",
+        f"  A-instructions:          {stats['a_instructions']:10d}",
+        f"  C-instructions:          {stats['c_instructions']:10d}",
+        f"  L-instructions (labels): {stats['l_instructions']:10d}",
+        f"  variables (RAM 16+):     {stats['variables']:10d}",
+        f"  distinct C-instructions: {stats['distinct_c_instructions']:10d}",
+    ])
+
+def print_stats(all_stats, stats_format):
+    """--stats 的輸出：text 逐檔印出，json 印成一個 JSON 陣列"""
+    if stats_format == "json":
+        print(json.dumps(all_stats, indent=2))
+    else:
+        for stats in all_stats:
+            print(format_stats(stats))
+
+def collect_asm_files(paths):
+    """把命令列給的檔案、目錄或 glob 樣式展開成 .asm 檔案列表 (去重、保持順序)"""
+    asm_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(path, '*.asm')))
+        elif glob.has_magic(path):
+            matches = sorted(glob.glob(path))
+        else:
+            matches = [path]
+        for match in matches:
+            if match not in asm_files:
+                asm_files.append(match)
+    return asm_files
+
+def assemble_batch(asm_files, jobs=None, **options):
+    """
+    用 process pool 平行組譯多個檔案 (每個檔案彼此獨立)，
+    印出每個檔案的耗時以及整體吞吐量 (instructions/s)。
+    """
+    start = time.perf_counter()
+    total_instructions = 0
+
+    all_stats = []
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(assemble_file, asm_file, **options) for asm_file in asm_files]
+        for asm_file, future in zip(asm_files, futures):
+            output_file, count, elapsed, stats = future.result()
+            total_instructions += count
+            if stats is not None:
+                all_stats.append(stats)
+            print(f"{asm_file} -> {output_file}: {count} instructions in {elapsed * 1000:.1f} ms")
+
+    wall_time = time.perf_counter() - start
+    rate = total_instructions / wall_time if wall_time > 0 else 0
+    print(f"Assembled {len(asm_files)} files, {total_instructions} instructions "
+          f"in {wall_time:.3f} s ({rate:,.0f} instructions/s)")
+    return all_stats
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Hack Assembler")
+    arg_parser.add_argument("inputs", nargs="+",
+                            help="Prog.asm，或包含 .asm 的目錄 / glob 樣式 (例如 '*.asm')")
+    arg_parser.add_argument("--single-pass", action="store_true",
+                            help="只讀一次檔案，最後回填標籤 (適合大型檔案)")
+    arg_parser.add_argument("--format", choices=["hack", "bin"], default="hack",
+                            help="hack: 文字機器碼 (預設)；bin: 每個指令 2 bytes 的 ROM 映像")
+    arg_parser.add_argument("--byteorder", choices=["little", "big"], default="little",
+                            help="bin 格式的位元組順序 (預設 little)")
+    arg_parser.add_argument("--cache", nargs="?", const="", default=None, metavar="DIR",
+                            help="使用內容雜湊快取，沒變的檔案 / 區塊不重新編碼 (預設放在輸入檔旁的 .asmcache)")
+    arg_parser.add_argument("--symbols", action="store_true",
+                            help="另外寫出 .sym 符號對照檔 (標籤 / 變數 -> 位址)")
+    arg_parser.add_argument("--source-map", action="store_true",
+                            help="輸入檔旁有 VM 轉譯器的 .map 時，換算成 ROM 位址寫出 .hack.map / .bin.map")
+    arg_parser.add_argument("-O", "--optimize", action="store_true",
+                            help="編碼前先做窺孔優化並回報刪掉的指令數 (會忽略 --single-pass / --cache)")
+    arg_parser.add_argument("--stats", nargs="?", const="text", choices=["text", "json"],
+                            help="印出各階段耗時與指令統計 (text 或 json，預設 text)")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=None,
+                            help="批次組譯時的 process 數量 (預設為 CPU 核心數)")
+    args = arg_parser.parse_args()
+
+    options = {
+        "single_pass": args.single_pass,
+        "output_format": args.format,
+        "byteorder": args.byteorder,
+        "cache_dir": args.cache,
+        "collect_stats": args.stats is not None,
+        "optimize": args.optimize,
+        "symbol_map": args.symbols,
+        "source_map": args.source_map,
+    }
+    asm_files = collect_asm_files(args.inputs)
+
+    if not asm_files:
+        print("No .asm files found.")
+        return
+
+    # 只有一個檔案就直接在本 process 組譯，省下開 pool 的成本
+    if len(asm_files) == 1 and not os.path.isdir(args.inputs[0]):
+        output_file, _, _, stats = assemble_file(asm_files[0], **options)
+        print(f"Assembly completed! Output: {output_file}")
+        all_stats = [stats] if stats else []
+    else:
+        all_stats = assemble_batch(asm_files, args.jobs, **options)
+
+    if args.stats:
+        print_stats(all_stats, args.stats)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,249 @@
+import time
+import argparse
+from array import array
+from bisect import bisect_right
+from Assembler import Code, load_binary, read_source_map
+
+def _reverse(table):
+    """二進位碼 -> 助記符；同一組 bits 有多種寫法時保留表中第一個 (標準寫法)"""
+    reversed_table = {}
+    for mnemonic, bits in table.items():
+        reversed_table.setdefault(bits, mnemonic)
+    return reversed_table
+
+# 反查表：直接沿用 Assembler 的 Code 對照表
+_DEST_BY_BITS = _reverse(Code.DEST_TABLE)
+_COMP_BY_BITS = _reverse(Code.COMP_TABLE)
+_JUMP_BY_BITS = _reverse(Code.JUMP_TABLE)
+
+# 停機慣用寫法裡的 "0;JMP" (comp 為 0、沒有 dest)：只有它保證跳回自己之後什麼狀態都不變
+_HALT_JUMP = int('111' + Code.COMP_TABLE['0'] + Code.DEST_TABLE['null'] + Code.JUMP_TABLE['JMP'], 2)
+
+# jump 助記符 -> 對 ALU 輸出 x 的判斷式
+_JUMP_CONDITIONS = {
+    'JGT': 'x > 0',
+    'JEQ': 'x == 0',
+    'JGE': 'x >= 0',
+    'JLT': 'x < 0',
+    'JNE': 'x != 0',
+    'JLE': 'x <= 0',
+    'JMP': 'True',
+}
+
+def _compile_c_instruction(word):
+    """
+    把一個 C 指令 word 編譯成 Python 函式 op(A, D, ram) -> (A, D, jump)。
+    jump 是跳轉目標 (沒跳就是 -1)。每種不同的 word 只會編譯一次。
+    """
+    bits = format(word, '016b')
+    comp = _COMP_BY_BITS.get(bits[3:10])
+    if comp is None:
+        raise ValueError(f"Invalid C-instruction: {bits}")
+    dest = _DEST_BY_BITS[bits[10:13]]
+    jump = _JUMP_BY_BITS[bits[13:16]]
+
+    lines = ["def op(A, D, ram):"]
+    if 'M' in comp:
+        lines.append("    M = ram[A & 32767]")
+    lines.append(f"    x = {comp.replace('!', '~')}")
+    if '+' in comp or '-' in comp:
+        # 16-bit 二補數溢位
+        lines.append("    x = ((x + 32768) & 65535) - 32768")
+    # 寫入 M 與跳轉都要用「舊的」A
+    if 'M' in dest:
+        lines.append("    ram[A & 32767] = x")
+    if jump == 'null':
+        lines.append("    jump = -1")
+    else:
+        lines.append(f"    jump = (A & 32767) if {_JUMP_CONDITIONS[jump]} else -1")
+    if 'D' in dest:
+        lines.append("    D = x")
+    if 'A' in dest.replace('null', ''):
+        lines.append("    A = x")
+    lines.append("    return A, D, jump")
+
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    return namespace['op']
+
+def cycles_by_function(counts, source_map):
+    """
+    依 source map (Assembler.read_source_map 的結果) 把每個位址的執行次數加總到 VM 函式。
+    map 第一筆之前的位址 (bootstrap 等) 歸到 "(unmapped)"。
+    共用子程式 (VM$CALL、VM$LT...) 在 map 裡有自己的起始位址，所以最後一個 VM 函式的範圍在它們前面就結束。
+    """
+    addresses, sources = source_map
+    totals = {}
+    for pc, count in enumerate(counts):
+        if count:
+            index = bisect_right(addresses, pc) - 1
+            function_name = sources[index][2] if index >= 0 else "(unmapped)"
+            totals[function_name] = totals.get(function_name, 0) + count
+    return totals
+
+class HackEmulator:
+    """
+    Hack CPU 模擬器。
+    載入時把每個 ROM word 解碼一次：A 指令存成 int，C 指令存成預先編譯好的函式，
+    執行時直接依 PC 取出來呼叫，不用每個 cycle 重新解碼。RAM 是 array('h') (有號 16-bit)。
+    """
+
+    RAM_SIZE = 32768
+
+    # 同一個 process 內共用：C 指令 word -> 編譯好的函式
+    _op_cache = {}
+
+    def __init__(self, rom):
+        self.rom = array('H', rom)
+        self.program = [self._decode(word) for word in self.rom]
+        # "(END) @END 0;JMP" 這種跳回自己的無窮迴圈視為停機；
+        # "@L / D=D+1;JMP" 之類每圈還會改變狀態的迴圈不算
+        self.halt_addresses = {
+            pc for pc in range(1, len(self.program))
+            if self.program[pc - 1] == pc - 1 and self.rom[pc] == _HALT_JUMP
+        }
+        self.ram = array('h', bytes(2 * self.RAM_SIZE))
+        self.reset()
+
+    @classmethod
+    def from_file(cls, filename, byteorder='little'):
+        """讀取 .hack 文字檔或 Assembler 產生的 .bin ROM 映像"""
+        if filename.endswith('.bin'):
+            return cls(load_binary(filename, byteorder))
+        with open(filename, 'r') as f:
+            return cls(int(line, 2) for line in f if line.strip())
+
+    def _decode(self, word):
+        if word < 0x8000:
+            return word # A 指令：直接存數值
+        op = self._op_cache.get(word)
+        if op is None:
+            op = _compile_c_instruction(word)
+            self._op_cache[word] = op
+        return op
+
+    def reset(self):
+        """重設 CPU (PC、A、D、cycle 計數)，RAM 保持不變"""
+        self.pc = 0
+        self.a = 0
+        self.d = 0
+        self.cycles = 0
+        self.halted = False
+
+    def run(self, max_cycles=None):
+        """
+        執行到停機、PC 超出 ROM，或用完 max_cycles 個 cycle 為止。
+        回傳這次呼叫實際執行的 cycle 數。
+        """
+        program = self.program
+        ram = self.ram
+        halt_addresses = self.halt_addresses
+        a, d, pc = self.a, self.d, self.pc
+        end = len(program)
+        budget = max_cycles if max_cycles is not None else float('inf')
+        cycles = 0
+
+        while cycles < budget and pc < end:
+            op = program[pc]
+            if op.__class__ is int:
+                a = op
+                pc += 1
+            else:
+                if pc in halt_addresses:
+                    self.halted = True
+                    break
+                a, d, jump = op(a, d, ram)
+                pc = jump if jump >= 0 else pc + 1
+            cycles += 1
+
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        return cycles
+
+    def profile(self, max_cycles=None):
+        """
+        同 run()，但另外記錄每個 ROM 位址執行了幾次 (比 run() 慢，所以分開寫)。
+        回傳 array('L')：counts[pc] 是位址 pc 的執行次數。
+        """
+        program = self.program
+        ram = self.ram
+        halt_addresses = self.halt_addresses
+        a, d, pc = self.a, self.d, self.pc
+        end = len(program)
+        budget = max_cycles if max_cycles is not None else float('inf')
+        counts = array('L', bytes(array('L').itemsize * end))
+        cycles = 0
+
+        while cycles < budget and pc < end:
+            op = program[pc]
+            counts[pc] += 1
+            if op.__class__ is int:
+                a = op
+                pc += 1
+            else:
+                if pc in halt_addresses:
+                    counts[pc] -= 1
+                    self.halted = True
+                    break
+                a, d, jump = op(a, d, ram)
+                pc = jump if jump >= 0 else pc + 1
+            cycles += 1
+
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        return counts
+
+    def peek(self, address):
+        return self.ram[address]
+
+    def poke(self, address, value):
+        self.ram[address] = value
+
+    def dump_ram(self, start=0, end=16):
+        """回傳 RAM[start:end] 的內容 (list)"""
+        return self.ram[start:end].tolist()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Hack CPU Emulator")
+    arg_parser.add_argument("program", help="Prog.hack 或 Prog.bin")
+    arg_parser.add_argument("--cycles", type=int, default=None,
+                            help="最多執行的 cycle 數 (預設跑到停機)")
+    arg_parser.add_argument("--set", action="append", default=[], metavar="ADDR=VALUE",
+                            help="執行前設定 RAM，例如 --set 0=256 (可重複)")
+    arg_parser.add_argument("--dump", default="0:16", metavar="START:END",
+                            help="執行後印出的 RAM 範圍 (預設 0:16)")
+    arg_parser.add_argument("--profile", nargs="?", const="", default=None, metavar="MAP",
+                            help="依 source map 統計各 VM 函式的 cycle 數 (預設讀 Prog.hack.map)")
+    arg_parser.add_argument("--top", type=int, default=20,
+                            help="--profile 印出前幾名函式 (預設 20)")
+    args = arg_parser.parse_args()
+
+    emulator = HackEmulator.from_file(args.program)
+    for assignment in args.set:
+        address, value = assignment.split('=')
+        emulator.poke(int(address), int(value))
+
+    start = time.perf_counter()
+    if args.profile is None:
+        cycles = emulator.run(args.cycles)
+    else:
+        counts = emulator.profile(args.cycles)
+        cycles = emulator.cycles
+    elapsed = time.perf_counter() - start
+
+    state = "halted" if emulator.halted else f"stopped at PC={emulator.pc}"
+    rate = cycles / elapsed if elapsed > 0 else 0
+    print(f"{args.program}: {cycles} cycles, {state} ({elapsed:.3f} s, {rate:,.0f} cycles/s)")
+
+    dump_start, dump_end = (int(x) for x in args.dump.split(':'))
+    for address, value in enumerate(emulator.dump_ram(dump_start, dump_end), dump_start):
+        print(f"RAM[{address}] = {value}")
+
+    if args.profile is not None:
+        totals = cycles_by_function(counts, read_source_map(args.profile or args.program + '.map'))
+        print(f"{'function':<40} {'cycles':>12} {'%':>6}")
+        for function_name, count in sorted(totals.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"{function_name:<40} {count:>12} {100 * count / max(cycles, 1):>6.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+class PeepholeOptimizer:
+    """
+    在組譯的「解析」與「編碼」之間，對清理過的 Hack 組合語言做窺孔優化 (Peephole Optimization)。
+
+    輸入輸出都是指令字串列表 (已去除註解與空白，標籤以 "(LABEL)" 形式保留)。
+    規則只看連續的指令，標籤會自然地切斷比對範圍，所以不會把跳轉目標合併掉。
+    每條規則都必須在任何執行狀態下與原本的程式等價 (A、D、M 的結果完全相同)。
+    """
+
+    def __init__(self):
+        # 規則名稱 -> 觸發次數
+        self.rule_counts = {name: 0 for name, _, _ in self.RULES}
+        self.removed = 0
+
+    # ---------- 輔助判斷 ----------
+
+    @staticmethod
+    def _is_a(instruction):
+        return instruction[0] == '@'
+
+    @staticmethod
+    def _is_label(instruction):
+        return instruction[0] == '('
+
+    @staticmethod
+    def _dest(instruction):
+        return instruction.split('=')[0] if '=' in instruction else ''
+
+    @staticmethod
+    def _has_jump(instruction):
+        return ';' in instruction
+
+    # ---------- 規則 ----------
+    # 每條規則收到結尾的 window (長度固定)，符合就回傳替換後的指令列表，否則回傳 None
+
+    @staticmethod
+    def _push_then_pop(window):
+        # @X / M=M+1 / AM=M-1  ->  @X / A=M
+        # RAM[X] 先加一再減一等於沒變，最後 A = RAM[X]。
+        # VM 轉譯器的 "@SP / M=M+1 / @SP / AM=M-1" 會先被 redundant_reload 化簡成這個形式
+        if PeepholeOptimizer._is_a(window[0]) and window[1:] == ['M=M+1', 'AM=M-1']:
+            return [window[0], 'A=M']
+        return None
+
+    @staticmethod
+    def _dead_a_instruction(window):
+        # @X / @Y  ->  @Y   (第一個 A 值還沒被用到就被覆蓋了)
+        if PeepholeOptimizer._is_a(window[0]) and PeepholeOptimizer._is_a(window[1]):
+            return [window[1]]
+        return None
+
+    @staticmethod
+    def _redundant_reload(window):
+        # @X / (不寫入 A 的 C 指令) / @X  ->  @X / (C 指令)   (A 還是 X，不用重新載入)
+        first, middle, last = window
+        if first == last and PeepholeOptimizer._is_a(first) and \
+           not PeepholeOptimizer._is_a(middle) and not PeepholeOptimizer._is_label(middle) and \
+           'A' not in PeepholeOptimizer._dest(middle):
+            return [first, middle]
+        return None
+
+    @staticmethod
+    def _jump_to_next(window):
+        # @L / comp;Jxx / (L) / @Y  ->  (L) / @Y
+        # 跳到下一行等於不跳；沒有 dest 的 C 指令也沒有副作用。
+        # 要求標籤後面緊接 A 指令，確保後續程式不會依賴「跳進來時 A == L」。
+        target, jump, label, following = window
+        if PeepholeOptimizer._is_a(target) and label == f"({target[1:]})" and \
+           PeepholeOptimizer._has_jump(jump) and '=' not in jump and \
+           PeepholeOptimizer._is_a(following):
+            return [label, following]
+        return None
+
+    # (名稱, window 長度, 規則函式)
+    RULES = [
+        ('push_then_pop', 3, _push_then_pop.__func__),
+        ('dead_a_instruction', 2, _dead_a_instruction.__func__),
+        ('redundant_reload', 3, _redundant_reload.__func__),
+        ('jump_to_next', 4, _jump_to_next.__func__),
+    ]
+
+    def optimize(self, instructions, line_numbers=None):
+        """
+        由左到右掃描，把指令一條條推進輸出堆疊，每推一條就檢查結尾是否符合任何規則；
+        替換後繼續檢查新的結尾，所以連鎖的優化機會一次掃描就能處理完。
+
+        有給 line_numbers (與 instructions 等長的原始行號) 時，同時把行號帶到輸出，
+        結果存在 self.line_numbers：替換後的指令如果原本就在 window 裡，沿用它的行號，
+        否則 (例如新產生的 "A=M") 用 window 第一條的行號。
+        """
+        output = []
+        output_lines = [] if line_numbers is not None else None
+        for index, instruction in enumerate(instructions):
+            output.append(instruction)
+            if output_lines is not None:
+                output_lines.append(line_numbers[index])
+            changed = True
+            while changed:
+                changed = False
+                for name, size, rule in self.RULES:
+                    if len(output) < size:
+                        continue
+                    window = output[-size:]
+                    replacement = rule(window)
+                    if replacement is not None:
+                        del output[-size:]
+                        output.extend(replacement)
+                        if output_lines is not None:
+                            window_lines = output_lines[-size:]
+                            del output_lines[-size:]
+                            output_lines.extend(window_lines[window.index(r)] if r in window else window_lines[0]
+                                                for r in replacement)
+                        self.rule_counts[name] += 1
+                        self.removed += size - len(replacement)
+                        changed = True
+                        break
+        self.line_numbers = output_lines
+        return output
+
+    def report(self):
+        """回傳一行優化摘要"""
+        details = ", ".join(f"{name}={count}" for name, count in self.rule_counts.items() if count)
+        return f"Peephole: removed {self.removed} instructions ({details or 'no rule matched'})"
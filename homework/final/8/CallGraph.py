@@ -0,0 +1,56 @@
+from Parser import C_FUNCTION, C_CALL
+
+class CallGraph:
+    """
+    整個程式 (所有 .vm 檔) 的函式呼叫圖，用來找出從進入點 (Sys.init) 走不到的函式。
+
+    programs 是 {檔名: VMCommand 列表}。一個函式的範圍是從它的 function 指令
+    到下一個 function 指令 (或檔案結尾) 之前；檔案開頭不屬於任何函式的指令一律保留。
+    """
+
+    def __init__(self, programs):
+        self.calls = {}      # 函式名 -> 它呼叫的函式名集合
+        self.sizes = {}      # 函式名 -> VM 指令數 (含 function 指令本身)
+        for commands in programs.values():
+            current = None
+            for command in commands:
+                if command.ctype == C_FUNCTION:
+                    current = command.arg1
+                    self.calls.setdefault(current, set())
+                    self.sizes[current] = 0
+                if current is None:
+                    continue
+                self.sizes[current] += 1
+                if command.ctype == C_CALL:
+                    self.calls[current].add(command.arg1)
+
+    def reachable(self, entry):
+        """從 entry 出發 (深度優先) 能呼叫到的所有函式"""
+        seen = set()
+        stack = [entry]
+        while stack:
+            name = stack.pop()
+            if name in seen or name not in self.calls:
+                continue
+            seen.add(name)
+            stack.extend(self.calls[name] - seen)
+        return seen
+
+    def prune(self, programs, entry):
+        """
+        回傳 (只保留可到達函式的新 programs, 被刪掉的函式名列表)。
+        呼叫了但沒定義的函式不處理，留給組譯時報錯。
+        """
+        keep = self.reachable(entry)
+        pruned = {}
+        for file_name, commands in programs.items():
+            kept_commands = []
+            keeping = True
+            for command in commands:
+                if command.ctype == C_FUNCTION:
+                    keeping = command.arg1 in keep
+                if keeping:
+                    kept_commands.append(command)
+            pruned[file_name] = kept_commands
+        dropped = sorted(name for name in self.calls if name not in keep)
+        return pruned, dropped
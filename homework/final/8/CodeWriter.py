@@ -1,22 +1,108 @@
 import os
+from Parser import C_FUNCTION
+
+class AsmTemplate:
+    """
+    預先編譯好的組合語言樣板。
+    寫法和傳給 _write_asm 的多行字串一樣 (可以有 // 註解)，但切行、去空白只在建立時做一次；
+    {名稱} 是每次輸出時才用 render() 填入的參數。
+    """
+
+    def __init__(self, source):
+        lines = [line.split('//')[0].strip() for line in source.strip().split('\n')]
+        self.lines = tuple(line for line in lines if line)
+        self.text = "".join(line + "\n" for line in self.lines)
+        self.instruction_count = sum(1 for line in self.lines if line[0] != '(')
+        self.has_slots = '{' in self.text
+
+    def render(self, **slots):
+        return self.text.format(**slots) if self.has_slots else self.text
 
 class CodeWriter:
-    def __init__(self, output_file):
-        self.output_file = open(output_file, 'w')
+    # call / return 的產生方式：
+    #   inline - 每個呼叫點與 return 都展開完整的保存/恢復程式碼 (原本的做法)
+    #   shared - 全程式只產生一份 VM$CALL / VM$RETURN 子程式，呼叫點只負責設定 R13、R14、D 後跳過去
+    CALL_MODES = ("inline", "shared")
+    # eq/gt/lt 的產生方式：
+    #   inline - 每次展開完整的比較與 TRUE_n/END_n 標籤 (原本的做法)
+    #   shared - 每種比較只產生一份 VM$EQ / VM$GT / VM$LT 子程式，使用處只要 4 條指令
+    COMPARE_MODES = ("inline", "shared")
+
+    # 比較運算 (含 VMOptimizer 產生的反向比較) -> 成立時的跳轉條件
+    COMPARE_JUMPS = {"eq": "JEQ", "gt": "JGT", "lt": "JLT", "ne": "JNE", "le": "JLE", "ge": "JGE"}
+
+    # function 的 local 數超過這個值就用迴圈清零，否則展開成 M=0 / AD=A+1 序列
+    LOCALS_LOOP_THRESHOLD = 8
+
+    def __init__(self, output_file, call_mode="inline", stack_cache=False, compare_mode="inline",
+                 locals_loop_threshold=LOCALS_LOOP_THRESHOLD):
+        if call_mode not in self.CALL_MODES:
+            raise ValueError(f"Unknown call mode: {call_mode}")
+        if compare_mode not in self.COMPARE_MODES:
+            raise ValueError(f"Unknown compare mode: {compare_mode}")
+        # 可以給檔名，也可以直接給一個可寫入的物件 (例如 io.StringIO，平行轉譯時產生片段用)
+        self.output_file = open(output_file, 'w') if isinstance(output_file, str) else output_file
+        self.call_mode = call_mode
+        self.compare_mode = compare_mode
+        self.locals_loop_threshold = locals_loop_threshold
+        # stack caching：把堆疊頂端留在 D 暫存器，不寫回記憶體
+        # top_in_d 為 True 時，邏輯上的堆疊 = RAM[256..SP) 再加上 D (SP 不包含這一格)
+        self.stack_cache = stack_cache
+        self.top_in_d = False
         self.file_name = ""  # 當前處理的 .vm 檔名 (用於 static 變數)
         self.function_name = "Sys.init" # 當前處理的函式名 (用於 label scope)
-        self.label_count = 0 # 用於生成唯一標籤 (如 EQ_TRUE_1)
+        self.label_count = 0 # 用於生成唯一標籤 (如 Main$TRUE_1，前面加檔名讓各檔案可以分開轉譯)
         self.call_count = 0  # 用於生成唯一的回傳地址標籤
+        self.instruction_count = 0 # 已輸出的 Hack 指令數 (不含標籤與註解) = ROM 大小
+        self.shared_routines = set() # 有被用到、要在 close() 時輸出的共用子程式
+        # 輸出緩衝：先累積在記憶體，滿 FLUSH_SIZE 個字元才一次寫進檔案
+        self.buffer = []
+        self.buffer_size = 0
+        self.line_count = 0 # 已輸出的 .asm 行數 (含註解與標籤)
+        # source map：每個 VM 指令一筆 (asm 起始行號, ROM 起始位址, 檔名, .vm 行號, 函式名)
+        self.source_map = []
 
     def setFileName(self, file_name):
         """通知 CodeWriter 目前正在處理哪個檔案"""
+        self.endFile()
         self.file_name = file_name
 
+    def endFile(self):
+        """目前的檔案結束：把留在 D 的堆疊頂端寫回記憶體"""
+        self._spill()
+
+    def markSource(self, command):
+        """記錄接下來輸出的組合語言來自哪個 VM 指令 (VMCommand)，供 source map 使用"""
+        function_name = command.arg1 if command.ctype == C_FUNCTION else self.function_name
+        self.source_map.append((self.line_count + 1, self.instruction_count,
+                                f"{self.file_name}.vm", command.line_number, function_name))
+
+    def _mark_routine(self, routine):
+        """
+        記錄接下來輸出的是共用子程式 (檔名記成 "(shared)")。
+        不記的話，source map 裡最後一個 VM 函式的範圍會一路延伸到 ROM 結尾，profiler 會把子程式的 cycle 算到它頭上。
+        """
+        self.source_map.append((self.line_count + 1, self.instruction_count, "(shared)", 0, routine))
+
+    def writeFragment(self, asm_text, instruction_count, shared_routines, source_map=()):
+        """
+        接上另一個 CodeWriter (通常在別的 process) 產生的組合語言片段。
+        片段用到的共用子程式會併入這裡，最後由 close() 統一輸出一份；
+        片段的 source map 位置是相對於片段開頭，這裡換算成整個檔案的位置。
+        """
+        line_offset, address_offset = self.line_count, self.instruction_count
+        self.source_map.extend((line + line_offset, address + address_offset, file_name, vm_line, function_name)
+                               for line, address, file_name, vm_line, function_name in source_map)
+        self._emit(asm_text, instruction_count)
+        self.shared_routines.update(shared_routines)
+
     def writeInit(self):
         """Chapter 8: 寫入 Bootstrap code"""
         # TODO: 
         # 1. @256, D=A, @SP, M=D (初始化 SP)
         # 2. 呼叫 writeCall('Sys.init', 0)
+        # 回傳標籤用獨立的名稱，避免和 Sys.init 自己的 Sys.init$ret.N 撞名
+        self.function_name = "Bootstrap"
         self._write_asm([
             "@256",
             "D=A",
@@ -24,28 +110,274 @@ class CodeWriter:
             "M=D"
         ])
         self.writeCall("Sys.init", 0)
-    def _write_binary_op(self, op):
-        """處理 add, sub, and, or"""
-        # 邏輯：SP--, D = y, SP--, M = x op y, SP++
-        # 優化後：
-        asm_code = f"""
+
+    # ================= 組合語言樣板 (import 時編譯一次) =================
+
+    # 邏輯：SP--, D = y, SP--, M = x op y, SP++
+    # 優化後：
+    BINARY_OP = AsmTemplate("""
         @SP
         AM=M-1
         D=M
         A=A-1
         M=M{op}D
-        """
-        self._write_asm(asm_code)
-    
-    def _write_unary_op(self, op):
-        """處理 neg, not"""
-        # 邏輯：直接修改堆疊頂端的值
-        asm_code = f"""
+    """)
+
+    # 邏輯：直接修改堆疊頂端的值
+    UNARY_OP = AsmTemplate("""
         @SP
         A=M-1
         M={op}M
-        """
-        self._write_asm(asm_code)
+    """)
+
+    # 邏輯：x - y，根據結果跳轉
+    COMPARE_OP = AsmTemplate("""
+        @SP
+        AM=M-1
+        D=M
+        A=A-1
+        D=M-D
+        @{label_true}
+        D;{jump}
+        @SP
+        A=M-1
+        M=0
+        @{label_end}
+        0;JMP
+        ({label_true})
+        @SP
+        A=M-1
+        M=-1
+        ({label_end})
+    """)
+
+    # push constant i
+    PUSH_CONSTANT = AsmTemplate("""
+        @{index}
+        D=A
+        @SP
+        A=M
+        M=D
+        @SP
+        M=M+1
+    """)
+
+    # push temp / pointer / static：來源是固定位址 (RAM[5+i]、THIS/THAT、FileName.i)
+    PUSH_FIXED = AsmTemplate("""
+        @{address}
+        D=M
+        @SP
+        A=M
+        M=D
+        @SP
+        M=M+1
+    """)
+
+    # pop temp / pointer / static
+    # 邏輯：addr = 固定位址, SP--, *addr = *SP
+    POP_FIXED = AsmTemplate("""
+        @SP
+        AM=M-1
+        D=M
+        @{address}
+        M=D
+    """)
+
+    # push local/argument/this/that
+    # 1. 計算來源位址 (Base + index) 2. 讀取該位址的值到 D 3. 將 D push 到堆疊
+    PUSH_SEGMENT = AsmTemplate("""
+        @{index}
+        D=A
+        @{base}
+        A=M+D
+        D=M
+        @SP
+        A=M
+        M=D
+        @SP
+        M=M+1
+    """)
+
+    # pop local/argument/this/that
+    # 1. 計算目標位址 (Base + index) 存入 R13 2. SP--, 取得值存入 D 3. 將 D 存入 *R13
+    POP_SEGMENT = AsmTemplate("""
+        @{index}
+        D=A
+        @{base}
+        D=M+D
+        @R13
+        M=D
+        @SP
+        AM=M-1
+        D=M
+        @R13
+        A=M
+        M=D
+    """)
+
+    # stack caching：*SP = D, SP++
+    SPILL = AsmTemplate("""
+        @SP
+        AM=M+1
+        A=A-1
+        M=D
+    """)
+
+    # SP--, D = *SP
+    POP_D = AsmTemplate("""
+        @SP
+        AM=M-1
+        D=M
+    """)
+
+    IF_GOTO = AsmTemplate("""
+        @SP
+        AM=M-1
+        D=M         // Pop top to D
+        @{label}
+        D;JNE       // Jump if D != 0
+    """)
+
+    # return：依據規格書恢復 FRAME, RET, SP, THAT, THIS, ARG, LCL
+    RETURN_BODY = AsmTemplate("""
+        // FRAME = LCL
+        @LCL
+        D=M
+        @R13        // R13 作為 FRAME 暫存器
+        M=D
+        // RET = *(FRAME - 5)
+        @5
+        A=D-A
+        D=M
+        @R14        // R14 作為 RET 暫存器
+        M=D
+        // *ARG = pop()
+        @SP
+        AM=M-1
+        D=M
+        @ARG
+        A=M
+        M=D
+        // SP = ARG + 1
+        @ARG
+        D=M+1
+        @SP
+        M=D
+        // THAT = *(FRAME - 1)
+        @R13
+        AM=M-1
+        D=M
+        @THAT
+        M=D
+        // THIS = *(FRAME - 2)
+        @R13
+        AM=M-1
+        D=M
+        @THIS
+        M=D
+        // ARG = *(FRAME - 3)
+        @R13
+        AM=M-1
+        D=M
+        @ARG
+        M=D
+        // LCL = *(FRAME - 4)
+        @R13
+        AM=M-1
+        D=M
+        @LCL
+        M=D
+        // goto RET
+        @R14
+        A=M
+        0;JMP
+    """)
+
+    # call：保存狀態 (Push ret, LCL, ARG, THIS, THAT) -> 調整 ARG/LCL -> goto -> 宣告 (ret)
+    CALL = AsmTemplate("""
+        // Push return address
+        @{return_label}
+        D=A
+        @SP
+        A=M
+        M=D
+        @SP
+        M=M+1
+        // Push LCL
+        @LCL
+        D=M
+        @SP
+        A=M
+        M=D
+        @SP
+        M=M+1
+        // Push ARG
+        @ARG
+        D=M
+        @SP
+        A=M
+        M=D
+        @SP
+        M=M+1
+        // Push THIS
+        @THIS
+        D=M
+        @SP
+        A=M
+        M=D
+        @SP
+        M=M+1
+        // Push THAT
+        @THAT
+        D=M
+        @SP
+        A=M
+        M=D
+        @SP
+        M=M+1
+        // Reposition ARG (ARG = SP - n - 5)
+        @SP
+        D=M
+        @{frame_offset}
+        D=D-A
+        @ARG
+        M=D
+        // Reposition LCL (LCL = SP)
+        @SP
+        D=M
+        @LCL
+        M=D
+        // Goto function
+        @{function_name}
+        0;JMP
+        // Declare return label
+        ({return_label})
+    """)
+
+    # shared call 模式的呼叫點：R13 = nArgs + 5, R14 = 函式位址, D = 回傳位址，其餘交給 VM$CALL
+    SHARED_CALL_SITE = AsmTemplate("""
+        @{frame_offset}
+        D=A
+        @R13
+        M=D
+        @{function_name}
+        D=A
+        @R14
+        M=D
+        @{return_label}
+        D=A
+        @VM$CALL
+        0;JMP
+        ({return_label})
+    """)
+
+    def _write_binary_op(self, op):
+        """處理 add, sub, and, or"""
+        self._write_template(self.BINARY_OP, op=op)
+    
+    def _write_unary_op(self, op):
+        """處理 neg, not"""
+        self._write_template(self.UNARY_OP, op=op)
 
     def writeArithmetic(self, command):
         """Chapter 7: 算術邏輯 (沿用你之前的代碼)"""
@@ -55,7 +387,11 @@ class CodeWriter:
         command: 字串 (例如 "add", "sub", "eq"...)
         """
         # 寫入註解方便除錯
-        self.output_file.write(f"// {command}\n")
+        self._emit(f"// {command}\n")
+
+        if self.stack_cache:
+            self._write_cached_arithmetic(command)
+            return
 
         if command == "add":
             self._write_binary_op("+")
@@ -70,41 +406,21 @@ class CodeWriter:
         elif command == "not":
             self._write_unary_op("!")
         elif command in ["eq", "gt", "lt"]:
-            self._write_compare_op(command)
+            if self.compare_mode == "shared":
+                self._write_shared_compare_call(command)
+            else:
+                self._write_compare_op(command)
         else:
             raise ValueError(f"Unknown command: {command}")
         pass
     def _write_compare_op(self, command):
         """處理 eq, gt, lt (最難的部分)"""
-        # 邏輯：x - y，根據結果跳轉
-        label_true = f"TRUE_{self.label_count}"
-        label_end = f"END_{self.label_count}"
+        label_true = f"{self.file_name}$TRUE_{self.label_count}"
+        label_end = f"{self.file_name}$END_{self.label_count}"
         self.label_count += 1
         
-        if command == "eq": jump_cmd = "JEQ"
-        elif command == "gt": jump_cmd = "JGT"
-        elif command == "lt": jump_cmd = "JLT"
-
-        asm_code = f"""
-        @SP
-        AM=M-1
-        D=M
-        A=A-1
-        D=M-D
-        @{label_true}
-        D;{jump_cmd}
-        @SP
-        A=M-1
-        M=0
-        @{label_end}
-        0;JMP
-        ({label_true})
-        @SP
-        A=M-1
-        M=-1
-        ({label_end})
-        """
-        self._write_asm(asm_code)
+        self._write_template(self.COMPARE_OP, label_true=label_true, label_end=label_end,
+                             jump=self.COMPARE_JUMPS[command])
 
     def writePushPop(self, command, segment, index):
         """
@@ -118,122 +434,219 @@ class CodeWriter:
         elif command == 2 or command == "pop":
             cmd_str = "pop"
             
-        self.output_file.write(f"// {cmd_str} {segment} {index}\n")
+        self._emit(f"// {cmd_str} {segment} {index}\n")
+
+        if self.stack_cache:
+            if cmd_str == "push":
+                self._write_cached_push(segment, index)
+            else:
+                self._write_cached_pop(segment, index)
+            return
 
         if cmd_str == "push":
             if segment == "constant":
                 # push constant i
-                asm_code = f"@{index}\nD=A\n@SP\nA=M\nM=D\n@SP\nM=M+1"
-                self._write_asm(asm_code)
+                self._write_template(self.PUSH_CONSTANT, index=index)
             
             elif segment in ["local", "argument", "this", "that"]:
                 self._write_push_from_segment(segment, index)
 
-            elif segment == "temp":
-                # push temp i (RAM[5+i])
-                asm_code = f"@{5 + index}\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1"
-                self._write_asm(asm_code)
-
-            elif segment == "pointer":
-                # push pointer 0/1 (0 -> THIS, 1 -> THAT)
-                label = "THIS" if index == 0 else "THAT"
-                asm_code = f"@{label}\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1"
-                self._write_asm(asm_code)
-
-            elif segment == "static":
-                # push static i (FileName.i)
-                static_label = f"{self.file_name}.{index}"
-                asm_code = f"@{static_label}\nD=M\n@SP\nA=M\nM=D\n@SP\nM=M+1"
-                self._write_asm(asm_code)
+            elif segment in ["temp", "pointer", "static"]:
+                # push temp i (RAM[5+i]) / pointer 0/1 (THIS/THAT) / static i (FileName.i)
+                self._write_template(self.PUSH_FIXED, address=self._static_address(segment, index))
         
         elif cmd_str == "pop":
             if segment in ["local", "argument", "this", "that"]:
                 self._write_pop_to_segment(segment, index)
 
-            elif segment == "temp":
-                # pop temp i (存入 RAM[5+i])
-                # 邏輯：addr = 5+i, SP--, *addr = *SP
-                asm_code = f"""
-                @SP
-                AM=M-1
-                D=M
-                @{5 + index}
-                M=D
-                """
-                self._write_asm(asm_code)
-
-            elif segment == "pointer":
-                # pop pointer 0/1
-                label = "THIS" if index == 0 else "THAT"
-                asm_code = f"""
-                @SP
-                AM=M-1
-                D=M
-                @{label}
-                M=D
-                """
-                self._write_asm(asm_code)
-
-            elif segment == "static":
-                # pop static i
-                static_label = f"{self.file_name}.{index}"
-                asm_code = f"""
-                @SP
-                AM=M-1
-                D=M
-                @{static_label}
-                M=D
-                """
-                self._write_asm(asm_code)
+            elif segment in ["temp", "pointer", "static"]:
+                # pop temp i (存入 RAM[5+i]) / pointer 0/1 / static i
+                self._write_template(self.POP_FIXED, address=self._static_address(segment, index))
 
     def _write_pop_to_segment(self, segment, index):
         """處理 pop local/argument/this/that"""
-        # 對應表
-        seg_map = {"local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT"}
-        base_label = seg_map[segment]
-
-        # 邏輯：
-        # 1. 計算目標位址 (Base + index) 存入 R13
-        # 2. SP--, 取得值存入 D
-        # 3. 將 D 存入 *R13
-        asm_code = f"""
-        @{index}
-        D=A
-        @{base_label}
-        D=M+D
-        @R13
-        M=D
-        @SP
-        AM=M-1
-        D=M
-        @R13
-        A=M
-        M=D
-        """
-        self._write_asm(asm_code)
+        self._write_template(self.POP_SEGMENT, index=index, base=self.SEGMENT_BASES[segment])
     
     def _write_push_from_segment(self, segment, index):
         """處理 push local/argument/this/that"""
-        # 這裡留給你練習填空
-        # 邏輯：
-        # 1. 計算來源位址 (Base + index)
-        seg_map = {"local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT"}
-        # 2. 讀取該位址的值到 D
-        base_label = seg_map[segment]
-        asm_code = f"""
-        @{index}
-        D=A
-        @{base_label}
-        A=M+D
-        D=M
-        @SP
-        A=M
-        M=D
-        @SP
-        M=M+1
+        self._write_template(self.PUSH_SEGMENT, index=index, base=self.SEGMENT_BASES[segment])
+
+    # ================= Stack caching 模式 =================
+    # 堆疊頂端留在 D：push 只把值載入 D，下一個指令若會吃掉它 (pop、算術、if-goto) 就不用經過記憶體。
+    # 遇到 label、goto、call、return、function 等控制流程邊界時才 spill 回記憶體，
+    # 確保不同路徑跳到同一個位置時，堆疊狀態一致 (全部在記憶體)。
+
+    SEGMENT_BASES = {"local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT"}
+
+    # pop 到 local/argument/this/that 時，index 不超過這個值就用 A=A+1 逐格前進，超過改用 R13/R14 計算位址
+    POP_STEP_LIMIT = 6
+
+    def _spill(self):
+        """如果堆疊頂端在 D，把它寫回記憶體 (*SP = D, SP++)"""
+        if not self.top_in_d:
+            return
+        self.top_in_d = False
+        self._write_template(self.SPILL)
+
+    def _pop_to_d(self):
+        """確保堆疊頂端的值在 D，並從邏輯堆疊上移除"""
+        if self.top_in_d:
+            self.top_in_d = False
+            return
+        self._write_template(self.POP_D)
+
+    def _static_address(self, segment, index):
+        """temp / pointer / static 的固定位址符號"""
+        if segment == "temp":
+            return str(5 + index)
+        if segment == "pointer":
+            return "THIS" if index == 0 else "THAT"
+        return f"{self.file_name}.{index}"
+
+    def _load_to_d(self, segment, index):
+        """回傳把 segment[index] 讀進 D 的指令列表"""
+        if segment == "constant":
+            if index in (0, 1):
+                asm = [f"D={index}"]
+            else:
+                asm = [f"@{index}", "D=A"]
+        elif segment in self.SEGMENT_BASES:
+            base = self.SEGMENT_BASES[segment]
+            if index == 0:
+                asm = [f"@{base}", "A=M", "D=M"]
+            elif index == 1:
+                asm = [f"@{base}", "A=M+1", "D=M"]
+            else:
+                asm = [f"@{index}", "D=A", f"@{base}", "A=M+D", "D=M"]
+        else:
+            asm = [f"@{self._static_address(segment, index)}", "D=M"]
+        return asm
+
+    def _store_d(self, segment, index):
+        """回傳把 D 寫進 segment[index] 的指令列表"""
+        if segment in self.SEGMENT_BASES:
+            base = self.SEGMENT_BASES[segment]
+            if index <= self.POP_STEP_LIMIT:
+                return [f"@{base}", "A=M"] + ["A=A+1"] * index + ["M=D"]
+            # D 裡是要寫入的值，先存到 R13，位址算好放 R14
+            return [
+                "@R13",
+                "M=D",
+                f"@{index}",
+                "D=A",
+                f"@{base}",
+                "D=M+D",
+                "@R14",
+                "M=D",
+                "@R13",
+                "D=M",
+                "@R14",
+                "A=M",
+                "M=D"
+            ]
+        return [f"@{self._static_address(segment, index)}", "M=D"]
+
+    def _write_cached_push(self, segment, index):
+        """把值載入 D，成為新的堆疊頂端 (原本在 D 的頂端先 spill)"""
+        self._spill()
+        self._write_asm(self._load_to_d(segment, index))
+        self.top_in_d = True
+
+    def _write_cached_pop(self, segment, index):
+        """把堆疊頂端 (D) 寫到目標位址"""
+        self._pop_to_d()
+        self._write_asm(self._store_d(segment, index))
+
+    def _write_cached_arithmetic(self, command):
+        """算術/邏輯指令：y 在 D，x 從記憶體 pop，結果留在 D"""
+        if command in ("neg", "not"):
+            op = "-" if command == "neg" else "!"
+            if self.top_in_d:
+                self._write_asm([f"D={op}D"])
+            else:
+                self._write_unary_op(op)
+            return
+
+        binary_ops = {"add": "+", "sub": "-", "and": "&", "or": "|"}
+        if command in binary_ops:
+            self._pop_to_d()
+            self._write_asm([
+                "@SP",
+                "AM=M-1",
+                f"D=M{binary_ops[command]}D"
+            ])
+            self.top_in_d = True
+            return
+
+        if command in ("eq", "gt", "lt") and self.compare_mode == "shared":
+            # 共用子程式從記憶體讀 x、y，結果也寫回記憶體
+            self._spill()
+            self._write_shared_compare_call(command)
+            return
+
+        if command in ("eq", "gt", "lt"):
+            label_true = f"{self.file_name}$TRUE_{self.label_count}"
+            label_end = f"{self.file_name}$END_{self.label_count}"
+            self.label_count += 1
+            jump_cmd = {"eq": "JEQ", "gt": "JGT", "lt": "JLT"}[command]
+            self._pop_to_d()
+            self._write_asm([
+                "@SP",
+                "AM=M-1",
+                "D=M-D",
+                f"@{label_true}",
+                f"D;{jump_cmd}",
+                "D=0",
+                f"@{label_end}",
+                "0;JMP",
+                f"({label_true})",
+                "D=-1",
+                f"({label_end})"
+            ])
+            self.top_in_d = True
+            return
+
+        raise ValueError(f"Unknown command: {command}")
+
+    def _write_shared_compare_call(self, command):
+        """shared compare 模式：D = 回傳位址，跳到 VM$EQ / VM$GT / VM$LT"""
+        routine = f"VM${command.upper()}"
+        return_label = f"{self.file_name}${command.upper()}_RET_{self.label_count}"
+        self.label_count += 1
+        self.shared_routines.add(command)
+        self._write_asm([
+            f"@{return_label}",
+            "D=A",
+            f"@{routine}",
+            "0;JMP",
+            f"({return_label})"
+        ])
+
+    def writeCompareIf(self, comparison, label):
+        """
+        處理 VMOptimizer 合併出來的「比較 + if-goto」(C_COMPARE_IF)。
+        直接依 x - y 的結果跳轉，不用先產生 -1/0 再判斷。
+        comparison 可以是 eq/gt/lt，或是中間夾了 not 的反向比較 ne/le/ge。
+        """
+        full_label = f"{self.function_name}${label}"
+        self._emit(f"// {comparison} / if-goto {label}\n")
+        self._pop_to_d()
+        self._write_asm([
+            "@SP",
+            "AM=M-1",
+            "D=M-D",
+            f"@{full_label}",
+            f"D;{self.COMPARE_JUMPS[comparison]}"
+        ])
+
+    def writeMove(self, source, target):
+        """
+        處理 VMOptimizer 合併出來的 push X / pop Y (C_MOVE)。
+        source、target 都是 (segment, index)，值直接經過 D 搬過去，不碰堆疊。
         """
-        # 3. 將 D push 到堆疊
-        self._write_asm(asm_code)
+        self._emit(f"// push {source[0]} {source[1]} / pop {target[0]} {target[1]}\n")
+        self._spill() # D 要拿來搬值
+        self._write_asm(self._load_to_d(*source) + self._store_d(*target))
 
     # ================= Chapter 8 新增區域 =================
 
@@ -243,6 +656,7 @@ class CodeWriter:
         格式: (functionName$label)
         """
         full_label = f"{self.function_name}${label}"
+        self._spill() # 跳進標籤的路徑都假設堆疊完整在記憶體裡
         self._write_asm([f"({full_label})"])
 
     def writeGoto(self, label):
@@ -251,6 +665,7 @@ class CodeWriter:
         格式: @functionName$label, 0;JMP
         """
         full_label = f"{self.function_name}${label}"
+        self._spill()
         self._write_asm([
             f"@{full_label}",
             "0;JMP"
@@ -262,32 +677,47 @@ class CodeWriter:
         邏輯: Pop stack -> D. If D != 0 jump to label.
         """
         full_label = f"{self.function_name}${label}"
-        self._write_asm([
-            "@SP", "AM=M-1", "D=M", # Pop top to D
-            f"@{full_label}",
-            "D;JNE" # Jump if D != 0
-        ])
+        if self.top_in_d:
+            # 條件值已經在 D，直接判斷；pop 掉之後堆疊回到記憶體狀態
+            self.top_in_d = False
+            self._write_asm([f"@{full_label}", "D;JNE"])
+            return
+        self._write_template(self.IF_GOTO, label=full_label)
+
+    # local 不多時：SP 只讀一次、寫一次，中間每個 local 兩條指令 (2n + 4 條，2n + 4 cycles)
+    #   @SP / A=M / M=0 / AD=A+1 / ... / M=0 / AD=A+1 / @SP / M=D
+    # local 很多時：D 當計數器，用 SP 本身當指標 (固定 9 條，7n + 2 cycles)
+    INIT_LOCALS_LOOP = AsmTemplate("""
+        @{num_locals}
+        D=A
+        ({loop_label})
+        @SP
+        AM=M+1
+        A=A-1
+        M=0
+        D=D-1
+        @{loop_label}
+        D;JGT
+    """)
 
     def writeFunction(self, function_name, num_locals):
         """
         處理 function command
         1. 宣告 (functionName) 標籤
-        2. push 0 到堆疊 num_locals 次
+        2. 把 num_locals 個 local 清成 0 (等同 push constant 0 num_locals 次)
         """
+        self._spill()
         self.function_name = function_name
         # TODO: 實作 function 邏輯
         self._write_asm([f"({function_name})"])
-        for _ in range(num_locals):
-            self._write_asm([
-                "@0",
-                "D=A",
-                "@SP",
-                "A=M",
-                "M=D",
-                "@SP",
-                "M=M+1"
-            ])
-        pass
+        if num_locals == 0:
+            return
+        if num_locals > self.locals_loop_threshold:
+            # VM 的 label 不能含 $，所以這個標籤不會和函式內的 label 撞名
+            self._write_template(self.INIT_LOCALS_LOOP, num_locals=num_locals,
+                                 loop_label=f"{function_name}$$INIT_LOCALS")
+        else:
+            self._write_asm(["@SP", "A=M"] + ["M=0", "AD=A+1"] * num_locals + ["@SP", "M=D"])
 
     def writeReturn(self):
         """
@@ -295,75 +725,13 @@ class CodeWriter:
         依據規格書恢復 FRAME, RET, SP, THAT, THIS, ARG, LCL
         """
         # TODO: 實作 return 邏輯
-        # FRAME = LCL
-        self._write_asm([
-            "@LCL",
-            "D=M",
-            "@R13",  # R13 作為 FRAME 暫存器
-            "M=D"
-        ])
-        # RET = *(FRAME - 5)
-        self._write_asm([
-            "@5",
-            "A=D-A",
-            "D=M",
-            "@R14",  # R14 作為 RET 暫存器
-            "M=D"
-        ])
-        # *ARG = pop()
-        self._write_asm([
-            "@SP",
-            "AM=M-1",
-            "D=M",
-            "@ARG",
-            "A=M",
-            "M=D"
-        ])
-        # SP = ARG + 1
-        self._write_asm([
-            "@ARG",
-            "D=M+1",
-            "@SP",
-            "M=D"
-        ])
-        # THAT = *(FRAME - 1)
-        self._write_asm([
-            "@R13",
-            "AM=M-1",
-            "D=M",
-            "@THAT",
-            "M=D"
-        ])
-        # THIS = *(FRAME - 2)
-        self._write_asm([
-            "@R13",
-            "AM=M-1",
-            "D=M",
-            "@THIS",
-            "M=D"
-        ])
-        # ARG = *(FRAME - 3)
-        self._write_asm([
-            "@R13",
-            "AM=M-1",
-            "D=M",
-            "@ARG",
-            "M=D"
-        ])
-        # LCL = *(FRAME - 4)
-        self._write_asm([
-            "@R13",
-            "AM=M-1",
-            "D=M",
-            "@LCL",
-            "M=D"
-        ])
-        # goto RET
-        self._write_asm([
-            "@R14",
-            "A=M",
-            "0;JMP"
-        ])
+        self._spill()
+        if self.call_mode == "shared":
+            # 整段恢復邏輯都在 VM$RETURN 裡，這裡只要跳過去
+            self.shared_routines.add("return")
+            self._write_asm(["@VM$RETURN", "0;JMP"])
+            return
+        self._write_template(self.RETURN_BODY)
 
     def writeCall(self, function_name, num_args):
         """
@@ -372,83 +740,166 @@ class CodeWriter:
         """
         return_label = f"{self.function_name}$ret.{self.call_count}"
         self.call_count += 1
+        self._spill() # 參數必須都在記憶體裡 (ARG 要指得到)
+
+        if self.call_mode == "shared":
+            self.shared_routines.add("call")
+            self._write_template(self.SHARED_CALL_SITE, frame_offset=num_args + 5,
+                                 function_name=function_name, return_label=return_label)
+            return
         
         # TODO: 實作 call 邏輯
+        self._write_template(self.CALL, frame_offset=num_args + 5,
+                             function_name=function_name, return_label=return_label)
+
+    # ================= 共用子程式 (shared call mode) =================
+
+    def _write_shared_call(self):
+        """
+        VM$CALL：進入時 D = 回傳位址, R13 = nArgs + 5, R14 = 被呼叫函式的位址。
+        依序 push ret, LCL, ARG, THIS, THAT，然後 ARG = SP - R13, LCL = SP, 跳到 R14。
+        """
         self._write_asm([
-            # Push return address
-            f"@{return_label}",
-            "D=A",
+            "(VM$CALL)",
+            # Push return address (D)
             "@SP",
             "A=M",
             "M=D",
-            "@SP",
-            "M=M+1",
-            # Push LCL
+            # Push LCL, ARG, THIS, THAT (邊 push 邊把 SP 往上推)
             "@LCL",
             "D=M",
             "@SP",
-            "A=M",
+            "AM=M+1",
             "M=D",
-            "@SP",
-            "M=M+1",
-            # Push ARG
             "@ARG",
             "D=M",
             "@SP",
-            "A=M",
+            "AM=M+1",
             "M=D",
-            "@SP",
-            "M=M+1",
-            # Push THIS
             "@THIS",
             "D=M",
             "@SP",
-            "A=M",
+            "AM=M+1",
             "M=D",
-            "@SP",
-            "M=M+1",
-            # Push THAT
             "@THAT",
             "D=M",
             "@SP",
-            "A=M",
+            "AM=M+1",
             "M=D",
+            # SP 指到 frame 之後，同時 LCL = SP
             "@SP",
-            "M=M+1",
-            # Reposition ARG (ARG = SP - n - 5)
-            "@SP",
-            "D=M",
-            f"@{num_args + 5}",
-            "D=D-A",
+            "MD=M+1",
+            "@LCL",
+            "M=D",
+            # ARG = SP - (nArgs + 5)
+            "@R13",
+            "D=D-M",
             "@ARG",
             "M=D",
-            # Reposition LCL (LCL = SP)
+            # Goto function
+            "@R14",
+            "A=M",
+            "0;JMP"
+        ])
+
+    def _write_shared_return(self):
+        """VM$RETURN：內容與 inline 的 return 相同，全程式只放一份"""
+        self._write_asm(["(VM$RETURN)"])
+        self._write_template(self.RETURN_BODY)
+
+    def _write_shared_compare(self, command):
+        """
+        VM$EQ / VM$GT / VM$LT：進入時 D = 回傳位址，x、y 在堆疊上。
+        先假設成立把 x 的位置寫成 -1，不成立再改成 0。
+        """
+        routine = f"VM${command.upper()}"
+        self._write_asm([
+            f"({routine})",
+            "@R15",
+            "M=D",
             "@SP",
+            "AM=M-1",
             "D=M",
-            "@LCL",
-            "M=D",
-            # Goto function
-            f"@{function_name}",
-            "0;JMP",
-            # Declare return label
-            f"({return_label})"
+            "A=A-1",
+            "D=M-D",
+            "M=-1",
+            f"@{routine}_END",
+            f"D;{self.COMPARE_JUMPS[command]}",
+            "@SP",
+            "A=M-1",
+            "M=0",
+            f"({routine}_END)",
+            "@R15",
+            "A=M",
+            "0;JMP"
         ])
-        pass
+
+    def _write_shared_routines(self):
+        """
+        在程式最後輸出有用到的共用子程式。
+        前面先放一個停機迴圈，避免程式直接往下執行時掉進子程式裡。
+        """
+        if not self.shared_routines:
+            return
+        self._emit("// shared routines\n")
+        self._mark_routine("VM$HALT")
+        self._write_asm(["(VM$HALT)", "@VM$HALT", "0;JMP"])
+        if "call" in self.shared_routines:
+            self._mark_routine("VM$CALL")
+            self._write_shared_call()
+        if "return" in self.shared_routines:
+            self._mark_routine("VM$RETURN")
+            self._write_shared_return()
+        for command in ("eq", "gt", "lt"):
+            if command in self.shared_routines:
+                self._mark_routine(f"VM${command.upper()}")
+                self._write_shared_compare(command)
 
     # ================= 輔助函式 =================
 
+    # 輸出緩衝累積到這麼多字元才真正寫進檔案
+    FLUSH_SIZE = 1 << 16
+
+    def _emit(self, text, instruction_count=0):
+        """把一段已經排好格式的組合語言 (每行以換行結尾) 放進輸出緩衝"""
+        self.buffer.append(text)
+        self.buffer_size += len(text)
+        self.line_count += text.count("\n")
+        self.instruction_count += instruction_count
+        if self.buffer_size >= self.FLUSH_SIZE:
+            self.flush()
+
+    def _write_template(self, template, **slots):
+        self._emit(template.render(**slots), template.instruction_count)
+
     def _write_asm(self, commands):
         # 如果傳進來的是單純的字串 (多行 f-string)，先幫它切開並去除空白
         if isinstance(commands, str):
-            lines = commands.strip().split('\n')
-            for line in lines:
-                clean_line = line.strip()
-                if clean_line: # 避免寫入空行
-                    self.output_file.write(clean_line + '\n')
-        # 如果傳進來的是列表 (List)
-        else:
-            for cmd in commands:
-                self.output_file.write(cmd + '\n')
+            commands = [line.strip() for line in commands.strip().split('\n') if line.strip()]
+        # 列表 (List) 一次組成一段文字
+        self._emit("".join(cmd + "\n" for cmd in commands),
+                   sum(1 for cmd in commands if cmd[0] != '('))
+
+    def flush(self):
+        """把緩衝內容一次寫進輸出檔"""
+        if self.buffer:
+            self.output_file.write("".join(self.buffer))
+            self.buffer.clear()
+            self.buffer_size = 0
+
+    def writeSourceMap(self, output_file):
+        """
+        寫出 source map：每個 VM 指令一行 "asm行號 ROM位址 檔名.vm 行號 函式名"，
+        共用子程式各一行 "asm行號 ROM位址 (shared) 0 子程式名"。
+        ROM 位址是直接組譯 (不做窺孔優化) 時的位址；組譯器加 --source-map 會依實際結果重新換算。
+        """
+        with open(output_file, 'w') as f:
+            f.write("// asm_line rom_address vm_file vm_line function\n")
+            f.writelines(f"{line} {address} {file_name} {vm_line} {function_name}\n"
+                         for line, address, file_name, vm_line, function_name in self.source_map)
 
     def close(self):
-        self.output_file.close()
\ No newline at end of file
+        self.endFile()
+        self._write_shared_routines()
+        self.flush()
+        self.output_file.close()
@@ -1,4 +1,5 @@
 import sys
+from collections import namedtuple
 
 # 定義指令類型常數
 C_ARITHMETIC = 0
@@ -10,29 +11,39 @@ C_IF = 5
 C_FUNCTION = 6
 C_RETURN = 7
 C_CALL = 8
+# 以下不是 .vm 檔裡的指令，只會由 VMOptimizer 在 IR 上產生
+C_MOVE = 9     # push X / pop Y 合併成的直接搬移：arg1 = (來源區段, index)，arg2 = (目標區段, index)
+C_COMPARE_IF = 10 # 比較 (+ not) / if-goto 合併成的條件跳轉：arg1 = label，arg2 = eq/gt/lt/ne/le/ge
+
+# 中間表示 (IR)：一個 VM 指令。arg1/arg2 與 Parser.arg1()/arg2() 相同，用不到的欄位為 None
+VMCommand = namedtuple('VMCommand', ['ctype', 'arg1', 'arg2', 'line_number'])
+
+def clean_lines(lines):
+    """
+    逐行去除註解 (// 之後) 與前後空白，跳過空行，產生 (行號, 指令) 配對。
+    行號從 1 開始，方便回報錯誤或對應回原始 .vm 檔。
+    """
+    for line_number, raw_line in enumerate(lines, 1):
+        command = raw_line.split('//')[0].strip()
+        if command:
+            yield line_number, command
 
 class Parser:
     def __init__(self, input_file):
+        # 讀檔時一次把註解與空行濾掉，只保留 (行號, 指令)
         with open(input_file, 'r') as f:
-            self.lines = f.readlines()
+            self.commands = list(clean_lines(f))
         self.current_command = ""
+        self.current_line_number = 0
         self.current_line_index = -1
 
     def hasMoreLines(self):
-        return self.current_line_index < len(self.lines) - 1
+        return self.current_line_index < len(self.commands) - 1
 
     def advance(self):
+        # 空行與註解已經濾掉，不用再遞迴跳過
         self.current_line_index += 1
-        line = self.lines[self.current_line_index]
-        # 移除註解與前後空白
-        line = line.split('//')[0].strip()
-        if not line: # 如果是空行，繼續讀下一行
-            if self.hasMoreLines():
-                self.advance()
-            else:
-                self.current_command = ""
-        else:
-            self.current_command = line
+        self.current_line_number, self.current_command = self.commands[self.current_line_index]
 
     def commandType(self):
         cmd = self.current_command.split(' ')[0]
@@ -57,4 +68,15 @@ class Parser:
         split_cmd = self.current_command.split(' ')
         if len(split_cmd) > 2:
             return int(split_cmd[2])
-        return 0
\ No newline at end of file
+        return 0
+
+    def readCommands(self):
+        """把剩下的指令全部解析成 VMCommand 列表 (IR)，讓優化器可以在產生組合語言前處理"""
+        commands = []
+        while self.hasMoreLines():
+            self.advance()
+            ctype = self.commandType()
+            arg1 = self.arg1() if ctype not in (C_RETURN, None) else None
+            arg2 = self.arg2() if ctype in (C_PUSH, C_POP, C_FUNCTION, C_CALL) else None
+            commands.append(VMCommand(ctype, arg1, arg2, self.current_line_number))
+        return commands
@@ -0,0 +1,382 @@
+import os
+import time
+import argparse
+from array import array
+from Parser import Parser, C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_RETURN, C_CALL
+
+# 與 Hack 平台相同的記憶體配置，VM 程式跑完的 RAM 可以直接和轉譯後的 .asm 比較
+SP, LCL, ARG, THIS, THAT = 0, 1, 2, 3, 4
+TEMP_BASE = 5
+STATIC_BASE = 16
+STACK_BASE = 256
+
+SEGMENT_POINTERS = {"local": LCL, "argument": ARG, "this": THIS, "that": THAT}
+
+def _wrap(x):
+    """16-bit 二補數溢位"""
+    return ((x + 32768) & 65535) - 32768
+
+class VMEmulator:
+    """
+    直接執行 .vm 程式的 VM 模擬器。
+
+    載入時用 Parser 把所有檔案讀成 VMCommand，再「編譯」成 (handler, a, b)：
+    handler 是從對照表查好的處理函式，a、b 是預先算好的參數 (常數、位址、跳轉目標的 index)。
+    label 不佔位置，goto / if-goto / call 直接帶整數目標，執行時不需要查表或比對字串。
+
+    RAM 用 array 存，SP、LCL、ARG、THIS、THAT、temp、static 的位置都和 Hack 平台相同。
+    一個 step 就是一個 VM 指令 (label 不算)。
+    """
+
+    RAM_SIZE = 32768
+
+    def __init__(self, vm_files):
+        # 'i' 而不是 'h'：儲存在 frame 裡的回傳位址是指令 index，可能超過 16-bit
+        self.ram = array('i', bytes(4 * self.RAM_SIZE))
+        self.handlers = self._build_handlers()
+        self.program = []
+        self.functions = {}       # 函式名 -> 進入點 index
+        self.source = []          # index -> (檔名, 行號)，方便除錯
+        self.static_addresses = {} # "File.i" -> RAM 位址 (依第一次出現的順序配置，和組譯器相同)
+        self._load(vm_files)
+        self.reset()
+
+    @classmethod
+    def from_path(cls, path):
+        """單一 .vm 檔，或目錄下所有 .vm 檔 (依檔名排序，和 VMTranslater 相同)"""
+        if os.path.isdir(path):
+            return cls([os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".vm")])
+        return cls([path])
+
+    # ---------- 載入與預先解析 ----------
+
+    def _static_address(self, file_name, index):
+        symbol = f"{file_name}.{index}"
+        if symbol not in self.static_addresses:
+            self.static_addresses[symbol] = STATIC_BASE + len(self.static_addresses)
+        return self.static_addresses[symbol]
+
+    def _fixed_address(self, file_name, segment, index):
+        """temp / pointer / static 的固定位址"""
+        if segment == "temp":
+            return TEMP_BASE + index
+        if segment == "pointer":
+            return THIS + index
+        return self._static_address(file_name, index)
+
+    def _load(self, vm_files):
+        h = self.handlers
+        labels = {}   # (函式名, label) -> index
+        pending = []  # (程式 index, 函式名, label)：goto / if-goto 等全部讀完再回填
+        calls = []    # (程式 index, 被呼叫的函式名)
+
+        for vm_file in vm_files:
+            file_name = os.path.basename(vm_file).replace(".vm", "")
+            function_name = ""
+            parser = Parser(vm_file)
+            for command in parser.readCommands():
+                ctype, arg1, arg2 = command.ctype, command.arg1, command.arg2
+                index = len(self.program)
+
+                if ctype == C_LABEL:
+                    labels[(function_name, arg1)] = index  # 不佔位置，指向下一個指令
+                    continue
+                if ctype == C_ARITHMETIC:
+                    instruction = (h[arg1], 0, 0)
+                elif ctype == C_PUSH:
+                    if arg1 == "constant":
+                        instruction = (h["push_constant"], arg2, 0)
+                    elif arg1 in SEGMENT_POINTERS:
+                        instruction = (h["push_segment"], SEGMENT_POINTERS[arg1], arg2)
+                    else:
+                        instruction = (h["push_fixed"], self._fixed_address(file_name, arg1, arg2), 0)
+                elif ctype == C_POP:
+                    if arg1 in SEGMENT_POINTERS:
+                        instruction = (h["pop_segment"], SEGMENT_POINTERS[arg1], arg2)
+                    else:
+                        instruction = (h["pop_fixed"], self._fixed_address(file_name, arg1, arg2), 0)
+                elif ctype in (C_GOTO, C_IF):
+                    instruction = (h["goto" if ctype == C_GOTO else "if-goto"], -1, 0)
+                    pending.append((index, function_name, arg1))
+                elif ctype == C_FUNCTION:
+                    function_name = arg1
+                    self.functions[arg1] = index
+                    instruction = (h["function"], arg2, 0)
+                elif ctype == C_CALL:
+                    instruction = (h["call"], -1, arg2)
+                    calls.append((index, arg1))
+                elif ctype == C_RETURN:
+                    instruction = (h["return"], 0, 0)
+                else:
+                    raise ValueError(f"{vm_file}:{command.line_number}: Unknown command")
+
+                self.program.append(instruction)
+                self.source.append((file_name, command.line_number))
+
+        # 最後放一個停機指令：bootstrap 與 call() 的回傳位址都指向這裡
+        self.halt_index = len(self.program)
+        self.program.append((h["halt"], 0, 0))
+        self.source.append(("", 0))
+
+        for index, function_name, label in pending:
+            if (function_name, label) not in labels:
+                raise ValueError(f"Unknown label: {function_name}${label}")
+            handler, _, _ = self.program[index]
+            target = labels[(function_name, label)]
+            # "label L / goto L" 這種跳回自己的無窮迴圈視為停機
+            if handler is h["goto"] and target == index:
+                handler = h["halt"]
+            self.program[index] = (handler, target, 0)
+        for index, callee in calls:
+            if callee not in self.functions:
+                raise ValueError(f"Unknown function: {callee}")
+            handler, _, num_args = self.program[index]
+            self.program[index] = (handler, self.functions[callee], num_args)
+
+    # ---------- 指令處理函式 ----------
+    # 每個處理函式收到 (pc, a, b)，回傳下一個 pc；回傳 -1 表示停機
+
+    def _build_handlers(self):
+        ram = self.ram
+
+        def push_constant(pc, value, _):
+            sp = ram[SP]
+            ram[sp] = value
+            ram[SP] = sp + 1
+            return pc + 1
+
+        def push_segment(pc, pointer, index):
+            sp = ram[SP]
+            ram[sp] = ram[ram[pointer] + index]
+            ram[SP] = sp + 1
+            return pc + 1
+
+        def push_fixed(pc, address, _):
+            sp = ram[SP]
+            ram[sp] = ram[address]
+            ram[SP] = sp + 1
+            return pc + 1
+
+        def pop_segment(pc, pointer, index):
+            sp = ram[SP] - 1
+            ram[ram[pointer] + index] = ram[sp]
+            ram[SP] = sp
+            return pc + 1
+
+        def pop_fixed(pc, address, _):
+            sp = ram[SP] - 1
+            ram[address] = ram[sp]
+            ram[SP] = sp
+            return pc + 1
+
+        def binary(operation):
+            def handler(pc, _a, _b):
+                sp = ram[SP] - 1
+                ram[sp - 1] = operation(ram[sp - 1], ram[sp])
+                ram[SP] = sp
+                return pc + 1
+            return handler
+
+        def unary(operation):
+            def handler(pc, _a, _b):
+                top = ram[SP] - 1
+                ram[top] = operation(ram[top])
+                return pc + 1
+            return handler
+
+        def goto(pc, target, _):
+            return target
+
+        def if_goto(pc, target, _):
+            sp = ram[SP] - 1
+            ram[SP] = sp
+            return target if ram[sp] != 0 else pc + 1
+
+        def function(pc, num_locals, _):
+            sp = ram[SP]
+            for address in range(sp, sp + num_locals):
+                ram[address] = 0
+            ram[SP] = sp + num_locals
+            return pc + 1
+
+        def call(pc, target, num_args):
+            sp = ram[SP]
+            ram[sp] = pc + 1
+            ram[sp + 1] = ram[LCL]
+            ram[sp + 2] = ram[ARG]
+            ram[sp + 3] = ram[THIS]
+            ram[sp + 4] = ram[THAT]
+            ram[ARG] = sp - num_args
+            ram[LCL] = ram[SP] = sp + 5
+            return target
+
+        def return_(pc, _a, _b):
+            frame = ram[LCL]
+            return_address = ram[frame - 5]
+            arg = ram[ARG]
+            ram[arg] = ram[ram[SP] - 1]
+            ram[SP] = arg + 1
+            ram[THAT] = ram[frame - 1]
+            ram[THIS] = ram[frame - 2]
+            ram[ARG] = ram[frame - 3]
+            ram[LCL] = ram[frame - 4]
+            return return_address
+
+        def halt(pc, _a, _b):
+            return -1
+
+        return {
+            "push_constant": push_constant,
+            "push_segment": push_segment,
+            "push_fixed": push_fixed,
+            "pop_segment": pop_segment,
+            "pop_fixed": pop_fixed,
+            "add": binary(lambda x, y: _wrap(x + y)),
+            "sub": binary(lambda x, y: _wrap(x - y)),
+            "and": binary(lambda x, y: x & y),
+            "or": binary(lambda x, y: x | y),
+            "eq": binary(lambda x, y: -1 if x == y else 0),
+            "gt": binary(lambda x, y: -1 if x > y else 0),
+            "lt": binary(lambda x, y: -1 if x < y else 0),
+            "neg": unary(lambda x: _wrap(-x)),
+            "not": unary(lambda x: ~x),
+            "goto": goto,
+            "if-goto": if_goto,
+            "function": function,
+            "call": call,
+            "return": return_,
+            "halt": halt,
+        }
+
+    # ---------- 執行 ----------
+
+    def reset(self):
+        """重設 pc 與計數 (RAM 保持不變)，從第一個指令開始執行"""
+        self.pc = 0
+        self.steps = 0
+        self.halted = False
+
+    def bootstrap(self, entry="Sys.init"):
+        """和 CodeWriter.writeInit 相同：SP = 256，call Sys.init (回傳位址指向停機指令)"""
+        self.ram[SP] = STACK_BASE
+        self.reset()
+        self.pc = self.handlers["call"](self.halt_index - 1, self.functions[entry], 0)
+
+    def run(self, max_steps=None):
+        """
+        執行到停機、pc 超出程式，或用完 max_steps 個 step 為止。
+        回傳這次呼叫實際執行的 step 數。
+        """
+        program = self.program
+        pc = self.pc
+        end = len(program)
+        budget = max_steps if max_steps is not None else float('inf')
+        steps = 0
+        while steps < budget and 0 <= pc < end:
+            handler, a, b = program[pc]
+            next_pc = handler(pc, a, b)
+            if next_pc < 0:
+                self.halted = True
+                break
+            pc = next_pc
+            steps += 1
+        self.pc = pc
+        self.steps += steps
+        return steps
+
+    def run_until_return(self, max_steps=None):
+        """執行到目前這個函式 return 回呼叫者為止 (以目前的 LCL 辨識 frame)，回傳 step 數"""
+        program = self.program
+        ram = self.ram
+        return_handler = self.handlers["return"]
+        frame = ram[LCL]
+        pc = self.pc
+        end = len(program)
+        budget = max_steps if max_steps is not None else float('inf')
+        steps = 0
+        while steps < budget and 0 <= pc < end:
+            handler, a, b = program[pc]
+            returning = handler is return_handler and ram[LCL] == frame
+            next_pc = handler(pc, a, b)
+            if next_pc < 0:
+                self.halted = True
+                break
+            pc = next_pc
+            steps += 1
+            if returning:
+                break
+        self.pc = pc
+        self.steps += steps
+        return steps
+
+    def call(self, function_name, *args, max_steps=None):
+        """
+        直接呼叫一個 VM 函式並回傳它的回傳值，例如 emulator.call("Main.fibonacci", 12)。
+        SP 還沒設定時從 256 開始。
+        """
+        ram = self.ram
+        if ram[SP] < STACK_BASE:
+            ram[SP] = STACK_BASE
+        for value in args:
+            sp = ram[SP]
+            ram[sp] = value
+            ram[SP] = sp + 1
+        self.reset()
+        self.pc = self.handlers["call"](self.halt_index - 1, self.functions[function_name], len(args))
+        self.run(max_steps)
+        sp = ram[SP] - 1
+        ram[SP] = sp
+        return ram[sp]
+
+    def peek(self, address):
+        return self.ram[address]
+
+    def poke(self, address, value):
+        self.ram[address] = value
+
+    def dump_ram(self, start=0, end=16):
+        """回傳 RAM[start:end] 的內容 (list)"""
+        return self.ram[start:end].tolist()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Nand2Tetris VM Emulator")
+    arg_parser.add_argument("input", help="單一 .vm 檔或包含 .vm 檔的目錄")
+    arg_parser.add_argument("--bootstrap", action="store_true",
+                            help="先設定 SP=256 並 call Sys.init (同 VMTranslater 的 --bootstrap)")
+    arg_parser.add_argument("--call", nargs="+", metavar=("FUNCTION", "ARG"),
+                            help="直接呼叫某個函式並印出回傳值，例如 --call Main.fibonacci 12")
+    arg_parser.add_argument("--steps", type=int, default=None,
+                            help="最多執行的 VM 指令數 (預設跑到停機)")
+    arg_parser.add_argument("--set", action="append", default=[], metavar="ADDR=VALUE",
+                            help="執行前設定 RAM，例如 --set 0=256 (可重複)")
+    arg_parser.add_argument("--dump", default="0:16", metavar="START:END",
+                            help="執行後印出的 RAM 範圍 (預設 0:16)")
+    args = arg_parser.parse_args()
+
+    emulator = VMEmulator.from_path(args.input)
+    for assignment in args.set:
+        address, value = assignment.split('=')
+        emulator.poke(int(address), int(value))
+
+    start = time.perf_counter()
+    if args.call:
+        function_name, call_args = args.call[0], [int(value) for value in args.call[1:]]
+        result = emulator.call(function_name, *call_args, max_steps=args.steps)
+        print(f"{function_name}({', '.join(map(str, call_args))}) = {result}")
+    else:
+        if args.bootstrap:
+            emulator.bootstrap()
+        emulator.run(args.steps)
+    elapsed = time.perf_counter() - start
+
+    steps = emulator.steps
+    state = "halted" if emulator.halted else f"stopped at index {emulator.pc}"
+    rate = steps / elapsed if elapsed > 0 else 0
+    print(f"{args.input}: {steps} steps, {state} ({elapsed:.3f} s, {rate:,.0f} steps/s)")
+
+    dump_start, dump_end = (int(x) for x in args.dump.split(':'))
+    for address, value in enumerate(emulator.dump_ram(dump_start, dump_end), dump_start):
+        print(f"RAM[{address}] = {value}")
+
+if __name__ == "__main__":
+    main()
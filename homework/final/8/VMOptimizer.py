@@ -0,0 +1,133 @@
+from Parser import VMCommand, C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_MOVE, C_COMPARE_IF
+
+class VMOptimizer:
+    """
+    在 Parser 與 CodeWriter 之間，對 VM 指令的 IR (VMCommand 列表) 做優化。
+
+    每個 pass 都只看連續的指令，label 本身也是一個指令，會自然地切斷比對範圍。
+    每個 pass 可以個別關閉，並記錄自己消掉了多少條 VM 指令。
+    """
+
+    # push constant 的合法範圍 (Hack 的 A 指令只能載入 0..32767)
+    MAX_CONSTANT = 32767
+
+    # 可以在編譯期算出結果的二元運算；結果超出 0..32767 就不折疊
+    FOLDABLE_OPS = {
+        'add': lambda x, y: x + y,
+        'sub': lambda x, y: x - y,
+        'and': lambda x, y: x & y,
+        'or': lambda x, y: x | y,
+    }
+
+    # 比較後面接 not 時改用相反的比較
+    NEGATED_COMPARISONS = {'eq': 'ne', 'gt': 'le', 'lt': 'ge'}
+
+    def __init__(self, disabled=()):
+        unknown = set(disabled) - set(self.PASS_NAMES)
+        if unknown:
+            raise ValueError(f"Unknown optimizer pass: {', '.join(sorted(unknown))}")
+        self.passes = [(name, run) for name, run in self.PASSES if name not in disabled]
+        # pass 名稱 -> 消掉的 VM 指令數
+        self.removed = {name: 0 for name, _ in self.passes}
+
+    # ---------- passes ----------
+    # 每個 pass 收到 VMCommand 列表，回傳 (新列表, 消掉的指令數)
+
+    @staticmethod
+    def _fold_constants(commands):
+        # push constant a / push constant b / add  ->  push constant (a+b)
+        # 用堆疊式掃描，連續的運算 (例如 1 + 2 + 3) 一次就能全部折疊
+        output = []
+        removed = 0
+        for command in commands:
+            output.append(command)
+            while len(output) >= 3:
+                x, y, op = output[-3:]
+                if not (op.ctype == C_ARITHMETIC and op.arg1 in VMOptimizer.FOLDABLE_OPS and
+                        x.ctype == C_PUSH and x.arg1 == 'constant' and
+                        y.ctype == C_PUSH and y.arg1 == 'constant'):
+                    break
+                value = VMOptimizer.FOLDABLE_OPS[op.arg1](x.arg2, y.arg2)
+                if not 0 <= value <= VMOptimizer.MAX_CONSTANT:
+                    break
+                del output[-3:]
+                output.append(VMCommand(C_PUSH, 'constant', value, x.line_number))
+                removed += 2
+        return output, removed
+
+    @staticmethod
+    def _fuse_push_pop(commands):
+        # push X / pop Y  ->  move X -> Y   (值不經過堆疊，直接搬)
+        output = []
+        removed = 0
+        for command in commands:
+            previous = output[-1] if output else None
+            if command.ctype == C_POP and previous is not None and previous.ctype == C_PUSH:
+                output[-1] = VMCommand(C_MOVE, (previous.arg1, previous.arg2),
+                                       (command.arg1, command.arg2), previous.line_number)
+                removed += 1
+            else:
+                output.append(command)
+        return output, removed
+
+    @staticmethod
+    def _remove_jump_to_next(commands):
+        # goto L / label L  ->  label L   (跳到下一行等於不跳)
+        output = []
+        removed = 0
+        for command in commands:
+            previous = output[-1] if output else None
+            if command.ctype == C_LABEL and previous is not None and \
+               previous.ctype == C_GOTO and previous.arg1 == command.arg1:
+                output[-1] = command
+                removed += 1
+            else:
+                output.append(command)
+        return output, removed
+
+    @staticmethod
+    def _fuse_compare_branch(commands):
+        # lt / if-goto L        ->  compare-if lt L
+        # lt / not / if-goto L  ->  compare-if ge L   (Jack 的 while/if 都會產生這種形式)
+        # 直接依 x - y 跳轉，不用先把 -1/0 放上堆疊再判斷
+        output = []
+        removed = 0
+        for command in commands:
+            output.append(command)
+            if command.ctype != C_IF or len(output) < 2:
+                continue
+            condition = output[-2]
+            if condition.ctype == C_ARITHMETIC and condition.arg1 in VMOptimizer.NEGATED_COMPARISONS:
+                del output[-2:]
+                output.append(VMCommand(C_COMPARE_IF, command.arg1, condition.arg1, condition.line_number))
+                removed += 1
+            elif condition.ctype == C_ARITHMETIC and condition.arg1 == 'not' and len(output) >= 3 and \
+                 output[-3].ctype == C_ARITHMETIC and output[-3].arg1 in VMOptimizer.NEGATED_COMPARISONS:
+                comparison = output[-3]
+                del output[-3:]
+                output.append(VMCommand(C_COMPARE_IF, command.arg1,
+                                        VMOptimizer.NEGATED_COMPARISONS[comparison.arg1], comparison.line_number))
+                removed += 2
+        return output, removed
+
+    # (名稱, pass 函式)，依序執行
+    PASSES = [
+        ('fold_constants', _fold_constants.__func__),
+        ('fuse_push_pop', _fuse_push_pop.__func__),
+        ('remove_jump_to_next', _remove_jump_to_next.__func__),
+        ('fuse_compare_branch', _fuse_compare_branch.__func__),
+    ]
+    PASS_NAMES = [name for name, _ in PASSES]
+
+    def optimize(self, commands):
+        """依序執行所有啟用的 pass，回傳優化後的 VMCommand 列表"""
+        for name, run in self.passes:
+            commands, removed = run(commands)
+            self.removed[name] += removed
+        return commands
+
+    def report(self):
+        """回傳一行優化摘要"""
+        total = sum(self.removed.values())
+        details = ", ".join(f"{name}={count}" for name, count in self.removed.items())
+        return f"VM optimizer: removed {total} VM commands ({details or 'all passes disabled'})"
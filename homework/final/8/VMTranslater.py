@@ -1,14 +1,117 @@
-import sys
+import io
 import os
-from Parser import Parser, C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_RETURN, C_CALL
+import time
+import argparse
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from Parser import Parser, C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_RETURN, C_CALL, C_MOVE, C_COMPARE_IF
 from CodeWriter import CodeWriter
+from VMOptimizer import VMOptimizer
+from CallGraph import CallGraph
+
+def write_command(code_writer, command):
+    """把一個 VMCommand (IR) 交給 CodeWriter 對應的方法"""
+    ctype = command.ctype
+    if ctype == C_ARITHMETIC:
+        code_writer.writeArithmetic(command.arg1)
+    elif ctype in [C_PUSH, C_POP]:
+        code_writer.writePushPop(ctype, command.arg1, command.arg2)
+    elif ctype == C_LABEL:
+        code_writer.writeLabel(command.arg1)
+    elif ctype == C_GOTO:
+        code_writer.writeGoto(command.arg1)
+    elif ctype == C_IF:
+        code_writer.writeIf(command.arg1)
+    elif ctype == C_FUNCTION:
+        code_writer.writeFunction(command.arg1, command.arg2)
+    elif ctype == C_RETURN:
+        code_writer.writeReturn()
+    elif ctype == C_CALL:
+        code_writer.writeCall(command.arg1, command.arg2)
+    elif ctype == C_MOVE:
+        code_writer.writeMove(command.arg1, command.arg2)
+    elif ctype == C_COMPARE_IF:
+        code_writer.writeCompareIf(command.arg2, command.arg1)
+
+def file_name_of(vm_file):
+    """Path/To/Main.vm -> Main (static 變數與標籤的前綴)"""
+    return os.path.basename(vm_file).replace(".vm", "")
+
+def translate_file(vm_file, writer_options, disabled_passes=None, source_map=False):
+    """
+    把單一 .vm 檔轉譯成一段獨立的組合語言片段 (可以在別的 process 執行)。
+    static 變數與比較用的標籤都以檔名為前綴，function 內的標籤以函式名為前綴，
+    所以各檔案的片段彼此不會撞名，可以直接依序接起來。
+    disabled_passes 為 None 表示不做 VM 層級優化。
+    source_map 為 True 時記錄每個 VM 指令對應的組合語言位置。
+    回傳 (組合語言, 指令數, 用到的共用子程式, 各優化 pass 消掉的指令數, source map)。
+    """
+    # 先把整個檔案解析成 IR，優化 (可選) 之後再產生組合語言
+    commands = Parser(vm_file).readCommands()
+    return translate_commands(file_name_of(vm_file), commands, writer_options, disabled_passes, source_map)
+
+def translate_commands(file_name, commands, writer_options, disabled_passes=None, source_map=False):
+    """同 translate_file，但輸入是已經解析好的 IR (例如刪掉無用函式之後)"""
+    removed = {}
+    if disabled_passes is not None:
+        optimizer = VMOptimizer(disabled=disabled_passes)
+        commands = optimizer.optimize(commands)
+        removed = optimizer.removed
+
+    fragment = io.StringIO()
+    code_writer = CodeWriter(fragment, **writer_options)
+    # 通知 CodeWriter 現在正在處理哪個檔 (為了 Static 變數命名)
+    code_writer.setFileName(file_name)
+    for command in commands:
+        if source_map:
+            code_writer.markSource(command)
+        write_command(code_writer, command)
+    code_writer.endFile()
+    code_writer.flush()
+    return (fragment.getvalue(), code_writer.instruction_count, code_writer.shared_routines, removed,
+            code_writer.source_map)
+
+def eliminate_dead_functions(programs, entry):
+    """用呼叫圖刪掉從 entry 走不到的函式，並印出刪掉了哪些"""
+    call_graph = CallGraph(programs)
+    if entry not in call_graph.calls:
+        print(f"Dead-function elimination skipped: {entry} not found")
+        return programs
+    pruned, dropped = call_graph.prune(programs, entry)
+    dropped_commands = sum(call_graph.sizes[name] for name in dropped)
+    print(f"Dead-function elimination: dropped {len(dropped)} of {len(call_graph.calls)} functions "
+          f"({dropped_commands} VM commands)")
+    for name in dropped:
+        print(f"  - {name} ({call_graph.sizes[name]} VM commands)")
+    return pruned
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python VMTranslator.py <input path>")
-        return
+    arg_parser = argparse.ArgumentParser(description="Nand2Tetris VM Translator")
+    arg_parser.add_argument("input", help="單一 .vm 檔或包含 .vm 檔的目錄")
+    arg_parser.add_argument("--bootstrap", action="store_true",
+                            help="在最前面寫入 Bootstrap code (SP=256, call Sys.init)")
+    arg_parser.add_argument("--call", choices=CodeWriter.CALL_MODES, default="inline",
+                            help="call/return 的產生方式：inline 每處展開，shared 共用一份子程式 (預設 inline)")
+    arg_parser.add_argument("--compare", choices=CodeWriter.COMPARE_MODES, default="inline",
+                            help="eq/gt/lt 的產生方式：inline 每處展開，shared 共用一份子程式 (預設 inline)")
+    arg_parser.add_argument("--locals-loop-threshold", type=int, default=CodeWriter.LOCALS_LOOP_THRESHOLD,
+                            metavar="N",
+                            help=f"function 的 local 超過 N 個時用迴圈清零，否則逐一展開 (預設 {CodeWriter.LOCALS_LOOP_THRESHOLD})")
+    arg_parser.add_argument("--stack-cache", action="store_true",
+                            help="把堆疊頂端留在 D 暫存器，只在 label/call/return 等邊界寫回記憶體")
+    arg_parser.add_argument("-O", "--optimize", action="store_true",
+                            help="產生組合語言前先對 VM 指令做優化 (常數折疊、push/pop 合併、移除跳到下一行的 goto、比較與跳轉合併)")
+    arg_parser.add_argument("--skip-pass", action="append", default=[], choices=VMOptimizer.PASS_NAMES,
+                            help="搭配 -O 關閉某個優化 pass (可重複)")
+    arg_parser.add_argument("--dce", action="store_true",
+                            help="建立呼叫圖，只輸出從 Sys.init 呼叫得到的函式 (其餘刪除並列出)")
+    arg_parser.add_argument("--source-map", action="store_true",
+                            help="另外寫出 .map，記錄每段組合語言來自哪個 .vm 檔、行號與函式")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=1,
+                            help="平行轉譯 .vm 檔的 process 數量 (預設 1，不開 process pool)")
+    args = arg_parser.parse_args()
 
-    input_path = sys.argv[1]
+    input_path = args.input
     vm_files = []
     output_file = ""
 
@@ -19,7 +122,8 @@ def main():
         dir_name = os.path.basename(input_path)
         output_file = os.path.join(input_path, dir_name + ".asm")
         
-        for file in os.listdir(input_path):
+        # 排序讓輸出順序固定，不受檔案系統影響
+        for file in sorted(os.listdir(input_path)):
             if file.endswith(".vm"):
                 vm_files.append(os.path.join(input_path, file))
     else:
@@ -27,42 +131,57 @@ def main():
         output_file = input_path.replace(".vm", ".asm")
         vm_files.append(input_path)
 
-    code_writer = CodeWriter(output_file)
+    writer_options = {
+        "call_mode": args.call,
+        "stack_cache": args.stack_cache,
+        "compare_mode": args.compare,
+        "locals_loop_threshold": args.locals_loop_threshold,
+    }
+    code_writer = CodeWriter(output_file, **writer_options)
     
     # 【關鍵】如果是目錄處理，通常需要加入 Bootstrap code
-    # 如果你正在測試 SimpleFunction (不需要 bootstrap)，可以先把這行註解掉
-    # if os.path.isdir(input_path):
-    #     code_writer.writeInit()
-
-    for vm_file in vm_files:
-        parser = Parser(vm_file)
-        # 通知 CodeWriter 現在正在處理哪個檔 (為了 Static 變數命名)
-        file_name_only = os.path.basename(vm_file).replace(".vm", "")
-        code_writer.setFileName(file_name_only)
-
-        while parser.hasMoreLines():
-            parser.advance()
-            ctype = parser.commandType()
-            
-            if ctype == C_ARITHMETIC:
-                code_writer.writeArithmetic(parser.arg1())
-            elif ctype in [C_PUSH, C_POP]:
-                code_writer.writePushPop(ctype, parser.arg1(), parser.arg2())
-            elif ctype == C_LABEL:
-                code_writer.writeLabel(parser.arg1())
-            elif ctype == C_GOTO:
-                code_writer.writeGoto(parser.arg1())
-            elif ctype == C_IF:
-                code_writer.writeIf(parser.arg1())
-            elif ctype == C_FUNCTION:
-                code_writer.writeFunction(parser.arg1(), parser.arg2())
-            elif ctype == C_RETURN:
-                code_writer.writeReturn()
-            elif ctype == C_CALL:
-                code_writer.writeCall(parser.arg1(), parser.arg2())
+    # 如果你正在測試 SimpleFunction (不需要 bootstrap)，不要加 --bootstrap
+    if args.bootstrap:
+        code_writer.writeInit()
+
+    optimizer = VMOptimizer(disabled=args.skip_pass) if args.optimize else None
+    disabled_passes = args.skip_pass if args.optimize else None
+
+    # 每個檔案各自轉譯成片段，再依檔案順序接在 bootstrap 後面；
+    # 平行與循序的輸出完全相同
+    start = time.perf_counter()
+    if args.dce:
+        # 刪除無用函式需要看到整個程式，所以先在這裡把全部檔案解析完
+        programs = {file_name_of(vm_file): Parser(vm_file).readCommands() for vm_file in vm_files}
+        programs = eliminate_dead_functions(programs, "Sys.init")
+        translate = translate_commands
+        fragment_args = (programs.keys(), programs.values(), repeat(writer_options), repeat(disabled_passes),
+                         repeat(args.source_map))
+    else:
+        translate = translate_file
+        fragment_args = (vm_files, repeat(writer_options), repeat(disabled_passes), repeat(args.source_map))
+
+    if args.jobs > 1 and len(vm_files) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            # 檔案很多時一次送一批給 worker，減少 process 間的往返
+            chunksize = max(1, len(vm_files) // (args.jobs * 4))
+            fragments = list(executor.map(translate, *fragment_args, chunksize=chunksize))
+    else:
+        fragments = list(map(translate, *fragment_args))
+
+    for asm_text, instruction_count, shared_routines, removed, source_map in fragments:
+        code_writer.writeFragment(asm_text, instruction_count, shared_routines, source_map)
+        for name, count in removed.items():
+            optimizer.removed[name] += count
 
     code_writer.close()
-    print(f"Successfully generated: {output_file}")
+    if args.source_map:
+        code_writer.writeSourceMap(output_file.replace(".asm", ".map"))
+    elapsed = time.perf_counter() - start
+    print(f"Successfully generated: {output_file} ({len(vm_files)} files in {elapsed * 1000:.1f} ms)")
+    print(f"ROM size: {code_writer.instruction_count} instructions (call mode: {args.call})")
+    if optimizer:
+        print(optimizer.report())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file